@@ -0,0 +1,196 @@
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+ROOT_PATH = Path(__file__).resolve().parents[1]
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+sys.path.insert(0, str(ROOT_PATH / "src"))
+
+PRINTER = "Bench_Printer"
+STUB_LP = f"""#!/bin/sh
+cat > /dev/null
+echo "request id is {PRINTER}-1 (1 file(s))"
+"""
+STUB_LPSTAT = f"""#!/bin/sh
+if [ "$1" = "-e" ]; then echo "{PRINTER}"; fi
+exit 0
+"""
+
+
+def _setup(workdir: Path):
+    # Stub executables on PATH, so the benchmarks run on any Linux box without CUPS
+    bin_path = workdir / "bin"
+    bin_path.mkdir()
+    for name, script in (("lp", STUB_LP), ("lpstat", STUB_LPSTAT), ("lpoptions", "#!/bin/sh\nexit 1\n")):
+        (bin_path / name).write_text(script)
+        (bin_path / name).chmod(0o755)
+    os.environ["PATH"] = f"{bin_path}{os.pathsep}{os.environ.get('PATH', '')}"
+
+    # The benchmarks run on their own config, the config of the installation stays untouched
+    from pex import config
+    config.CONFIG_FILE = workdir / "config.json"
+    config.LEGACY_CONFIG_FILE = workdir / "pexconfig.json"
+    settings = config.load_config()
+    settings["printer_default"] = PRINTER
+    settings["render"] = {"cache_size": 0}
+    settings["documents"] = {"max_size": 0}
+    settings["jobs"] = {"persistent": False, "max_queued": 0, "max_queued_bytes": 0}
+    settings["uploads"] = {"max_size": 64 * 1024 * 1024, "memory_limit": 4 * 1024 * 1024, "require_pdf": True}
+    config.save_config(settings)
+
+
+def _label(count: int, fonts: tuple[str, ...] = ("helvetica",)) -> list[dict]:
+    from pex.services import labels
+    lines = []
+    for i in range(count):
+        lines.append(labels.normalize_line({
+            "text": f"Article {i:04d} - Shelf {i % 12} - EUR {i * 1.25:.2f}",
+            "font": fonts[i % len(fonts)],
+            "bold": i % 3 == 1,
+            "italic": i % 4 == 2,
+        }))
+    return lines
+
+
+def _benchmarks() -> dict[str, Callable[[], object]]:
+    from fpdf import FPDF
+    from pex import config
+    from pex.services import labels, printer, server
+
+    short = _label(3)
+    long = _label(50)
+    fonts = _label(12, ("helvetica", "times", "courier"))
+    paragraph = labels.normalize_line(" ".join(f"word{i}" for i in range(400)))
+    pdf = FPDF(unit="mm", format=(62, 29))
+    pdf.add_page()
+    pdf.set_font("helvetica", size=10)
+
+    client = server.app.test_client()
+    upload = b"%PDF-1.4\n" + os.urandom(8 * 1024 * 1024)
+
+    def post_upload():
+        response = client.post("/pex/print", data={
+            "printer": PRINTER,
+            "file": (io.BytesIO(upload), "bench.pdf"),
+        }, content_type="multipart/form-data")
+        assert response.status_code == 202, response.json
+
+    def post_lines():
+        response = client.post("/pex/print", data={
+            "printer": PRINTER,
+            "format": "label",
+            "lines": ["Shelf 12", '{"text": "EUR 4.99", "bold": true}', "Article 0042"],
+        })
+        assert response.status_code == 202, response.json
+
+    return {
+        "wrap_text_short": lambda: labels._wrap_text(short[0], pdf, 58),
+        "wrap_text_paragraph": lambda: labels._wrap_text(paragraph, pdf, 58),
+        "render_label_short": lambda: labels.render_lines(short, (62, 29)),
+        "render_label_50_lines": lambda: labels.render_lines(long, (62, 290)),
+        "render_label_multi_font": lambda: labels.render_lines(fonts, (62, 100)),
+        "config_get_option": lambda: config.get_option("server.port"),
+        "resolve_paper_format_name": lambda: printer.resolve_paper_format("A4"),
+        "resolve_paper_format_size": lambda: printer.resolve_paper_format((62, 29)),
+        "post_print_lines": post_lines,
+        "post_print_upload_8mb": post_upload,
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int = 5, min_time: float = 0.1) -> dict:
+    fn()
+
+    # Calibrate the number of calls per round, so each round runs for at least min_time seconds
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+
+    rounds = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return {
+        "median": statistics.median(rounds),
+        "min": min(rounds),
+        "calls": number * repeat,
+    }
+
+
+def _format_time(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.2f} us"
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="PEX microbenchmarks")
+    p.add_argument("-k", "--filter", help="Only run benchmarks containing this string")
+    p.add_argument("--repeat", type=int, default=5, help="Rounds per benchmark")
+    p.add_argument("--min-time", type=float, default=0.1, help="Minimum seconds per round")
+    p.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="Baseline JSON file")
+    p.add_argument("--save", action="store_true", help="Save the results as new baseline")
+    p.add_argument("--threshold", type=float, default=float(os.environ.get("PEX_BENCH_THRESHOLD", 0.25)),
+                   help="Allowed slowdown against the baseline (0.25 = 25%%)")
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="pex-bench-") as workdir:
+        _setup(Path(workdir))
+        from pex.services import jobs
+        benchmarks = _benchmarks()
+
+        baseline = {}
+        if args.baseline.exists():
+            baseline = json.loads(args.baseline.read_text(encoding="utf-8")).get("results", {})
+
+        results = {}
+        regressions = []
+        print(f"{'benchmark':<28} {'median':>12} {'baseline':>12} {'change':>9}")
+        for name, fn in benchmarks.items():
+            if args.filter and args.filter not in name:
+                continue
+            result = results[name] = measure(fn, args.repeat, args.min_time)
+            jobs.get_queue().join()
+            previous = baseline.get(name, {}).get("median")
+            change = ""
+            if previous:
+                ratio = result["median"] / previous - 1
+                change = f"{ratio:+.1%}"
+                if ratio > args.threshold:
+                    regressions.append(name)
+                    change += " !"
+            print(f"{name:<28} {_format_time(result['median']):>12} "
+                  f"{_format_time(previous) if previous else '-':>12} {change:>9}")
+
+    if args.save:
+        args.baseline.write_text(json.dumps({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }, indent=2), encoding="utf-8")
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions and not args.save:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
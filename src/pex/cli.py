@@ -1,11 +1,8 @@
 import argparse
 import subprocess
+import sys
 from typing import Callable
-from .ui import app
-from .config import get_option, set_option, delete_option
-from .updater import perform as perform_update
 from .utils import coerce_values, SimpleFormatter
-from .services import service
 from .version import __VERSION__
 
 
@@ -24,41 +21,76 @@ def _cmd_help(_: argparse.Namespace) -> int:
     return _wrap_noop(build_parser().print_help)
 
 
-def _cmd_run(_: argparse.Namespace) -> int:
+def _cmd_run(args: argparse.Namespace) -> int:
+    if args.use_async:
+        from .services import aserver
+        aserver.run()
+        return 0
     from .services import server
     server.run()
     return 0
 
 
+def _import_time_report(argv: list[str], limit: int = 15) -> int:
+    # Re-runs the command with "python -X importtime" and summarizes the slowest imports afterwards
+    proc = subprocess.Popen([sys.executable, "-X", "importtime", "-m", "pex", *argv], stderr=subprocess.PIPE, text=True)
+    timings: list[tuple[int, int, int, str]] = []
+    for line in proc.stderr:
+        if not line.startswith("import time:"):
+            sys.stderr.write(line)
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].rstrip("\n").split("|", 2)
+        if self_us.strip().isdigit():
+            level = (len(name) - len(name.lstrip()) - 1) // 2
+            timings.append((int(cumulative_us), int(self_us), level, name.strip()))
+    code = proc.wait()
+
+    total = sum(cumulative for cumulative, _, level, _ in timings if level == 0)
+    print(f"\nImport time: {total / 1000:.1f} ms ({len(timings)} modules)")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_us, level, name in sorted(timings, reverse=True)[:limit]:
+        print(f"{cumulative / 1000:>9.1f} ms {self_us / 1000:>7.1f} ms  {name}")
+    return code
+
+
 def _cmd_install(_: argparse.Namespace) -> int:
+    from .services import service
     return _wrap_service(service.install)
 
 
 def _cmd_uninstall(_: argparse.Namespace) -> int:
+    from .services import service
     return _wrap_service(service.uninstall)
 
 
 def _cmd_status(_: argparse.Namespace) -> int:
+    from .services import service
     return _wrap_service(service.status)
 
 
 def _cmd_start(_: argparse.Namespace) -> int:
+    from .services import service
     return _wrap_service(service.start)
 
 
 def _cmd_restart(_: argparse.Namespace) -> int:
+    from .services import service
     return _wrap_service(service.restart)
 
 
 def _cmd_stop(_: argparse.Namespace) -> int:
+    from .services import service
     return _wrap_service(service.stop)
 
 
 def _cmd_ui(_: argparse.Namespace) -> int:
+    from .ui import app
     return _wrap_noop(lambda: app.run(True))
 
 
 def _cmd_update(_: argparse.Namespace) -> int:
+    from .updater import perform as perform_update
+
     def cli_log(msg: str) -> None:
         if msg:
             print(msg)
@@ -68,6 +100,8 @@ def _cmd_update(_: argparse.Namespace) -> int:
 
 
 def _cmd_config(args: argparse.Namespace) -> int:
+    from .config import get_option, set_option, delete_option
+
     key = args.option
     values = args.value
 
@@ -101,10 +135,12 @@ def build_parser() -> argparse.ArgumentParser:
             "  pex config server.port 4123          # set value\n"
             "  pex restart\n"
             "  pex update\n"
+            "  pex --import-time status             # report slow imports\n"
         ),
         formatter_class=SimpleFormatter,
     )
     p.add_argument("--version", action="version", version=f"PEX - Printer Execution Service v{__VERSION__}")
+    p.add_argument("--import-time", action="store_true", help="Report the import times of the command")
 
     sub = p.add_subparsers(dest="cmd", title="Commands", required=True)
     sub.add_parser("help", help="Show this help message").set_defaults(func=_cmd_help)
@@ -116,7 +152,9 @@ def build_parser() -> argparse.ArgumentParser:
     sub.add_parser("restart", help="Restart the printer service").set_defaults(func=_cmd_restart)
     sub.add_parser("stop", help="Stop the printer service").set_defaults(func=_cmd_stop)
     sub.add_parser("update", help="Update PEX").set_defaults(func=_cmd_update)
-    sub.add_parser("run", help="Run FLASK Server without service").set_defaults(func=_cmd_run)
+    cmd = sub.add_parser("run", help="Run FLASK Server without service")
+    cmd.add_argument("--async", dest="use_async", action="store_true", help="Serve on an asyncio event loop instead of Waitress")
+    cmd.set_defaults(func=_cmd_run)
     cmd = sub.add_parser(
         "config",
         help="Get or Set a config value",
@@ -143,6 +181,9 @@ def build_parser() -> argparse.ArgumentParser:
 def main(argv: list[str] | None = None) -> int:
     parser = build_parser()
     args = parser.parse_args(argv)
+    if args.import_time:
+        argv = list(sys.argv[1:] if argv is None else argv)
+        return _import_time_report([arg for arg in argv if arg != "--import-time"])
     try:
         func = getattr(args, "func")
     except AttributeError:
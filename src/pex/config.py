@@ -1,6 +1,11 @@
+import copy
 import json
 import os
+import tempfile
+import threading
+import time
 from pathlib import Path
+from typing import Callable, Tuple
 from .utils import deep_get, deep_set, deep_delete
 
 ROOT_PATH = Path(__file__).resolve().parents[2]
@@ -9,6 +14,70 @@ DEFAULT_CONFIG_FILE = (ROOT_PATH / "_default_config.json")
 LEGACY_CONFIG_FILE = (ROOT_PATH / "pexconfig.json")
 
 
+class FrozenDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The configuration snapshot is read-only, use set_option instead.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+class FrozenList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The configuration snapshot is read-only, use set_option instead.")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return FrozenList(_freeze(v) for v in value)
+    return value
+
+
+def _compile_formats(formats) -> Tuple[dict, dict]:
+    compiled = {}
+    errors = {}
+    if not isinstance(formats, dict):
+        return compiled, errors
+
+    for name, fmt in formats.items():
+        if not fmt:
+            continue
+        if not isinstance(fmt, (list, tuple)) or len(fmt) < 2:
+            errors[name] = f"Invalid format entry for '{name}' in config."
+            continue
+        width, height = fmt[0], fmt[1]
+        if not (isinstance(width, (int, float)) and isinstance(height, (int, float))):
+            errors[name] = f"Invalid numeric values in format '{name}'."
+            continue
+        compiled[name] = (width, height)
+    return compiled, errors
+
+
+class ConfigSnapshot:
+    def __init__(self, config: dict, stamp: tuple | None = None):
+        self.stamp = stamp
+        self.raw = config
+        self.data = _freeze(config)
+
+        printers = config.get("printers") if isinstance(config, dict) else None
+        self.printers = FrozenDict(
+            (alias, name) for alias, name in (printers or {}).items() if isinstance(name, str) and name
+        )
+        self.formats, self.format_errors = _compile_formats(config.get("formats") if isinstance(config, dict) else None)
+
+    def get(self, name: str, default=''):
+        return deep_get(self.data, name, default)
+
+
+_snapshot: ConfigSnapshot | None = None
+_snapshot_lock = threading.RLock()
+_reload_hooks: list[Callable[[float], None]] = []
+
+
 def _default_config():
     config = {}
     if os.path.exists(DEFAULT_CONFIG_FILE):
@@ -50,7 +119,15 @@ def _migrate_config() -> bool:
         return False
 
 
-def load_config():
+def _stamp() -> tuple | None:
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _read_config() -> dict:
     if os.path.exists(LEGACY_CONFIG_FILE):
         _migrate_config()
 
@@ -62,14 +139,73 @@ def load_config():
         return json.load(f)
 
 
+def get_snapshot() -> ConfigSnapshot:
+    global _snapshot
+    stamp = _stamp()
+    current = _snapshot
+    if current is not None and stamp is not None and current.stamp == stamp:
+        return current
+
+    with _snapshot_lock:
+        stamp = _stamp()
+        if _snapshot is not None and stamp is not None and _snapshot.stamp == stamp:
+            return _snapshot
+        start = time.perf_counter()
+        try:
+            config = _read_config()
+        except ValueError as e:
+            if _snapshot is None:
+                raise
+            print(f"Config reload failed, keeping previous configuration: {e}")
+            _snapshot.stamp = stamp
+            return _snapshot
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in _reload_hooks:
+                hook(elapsed)
+        _snapshot = ConfigSnapshot(config, _stamp())
+        return _snapshot
+
+
+def add_reload_hook(hook: Callable[[float], None]):
+    # Called with the duration of every config reload, e.g. by the metrics (config must not import the services)
+    _reload_hooks.append(hook)
+
+
+def invalidate():
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def load_config():
+    return copy.deepcopy(get_snapshot().raw)
+
+
 def save_config(config):
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump(config, f, indent=2)
+    directory = os.path.dirname(CONFIG_FILE)
+    fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".json.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(CONFIG_FILE).st_mode & 0o777)
+        except OSError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, CONFIG_FILE)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    invalidate()
 
 
 def get_option(name: str, default=''):
-    config = load_config()
-    return deep_get(config, name, default)
+    return get_snapshot().get(name, default)
 
 
 def set_option(name: str, value):
@@ -0,0 +1,326 @@
+import asyncio
+import json
+import socket
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote_to_bytes
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from . import jobs, metrics, server, spool
+from .documents import PDF_MAGIC
+from .. import config
+from ..version import __VERSION__
+
+MAX_HEADER_SIZE = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_connections = 0
+
+metrics.gauge("pex_async_connections", "Open connections of the asyncio server.", lambda: _connections)
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, details: dict | None = None, headers: list[tuple[str, str]] | None = None):
+        super().__init__(message)
+        self.status = status
+        self.details = details or {}
+        self.headers = headers or []
+
+
+class UploadCheck:
+    # Rejects file parts which are not PDF documents on their first bytes, as SpoolStream does once Flask parses the body
+    def __init__(self, boundary: bytes):
+        self._decoder: MultipartDecoder | None = MultipartDecoder(boundary)
+        self._head: bytes | None = None
+
+    @classmethod
+    def create(cls, content_type: str) -> "UploadCheck | None":
+        mimetype, options = parse_options_header(content_type)
+        if mimetype != "multipart/form-data" or not options.get("boundary"):
+            return None
+        if config.get_option("uploads.require_pdf", True) is False:
+            return None
+        return cls(options["boundary"].encode("latin-1"))
+
+    def feed(self, data: bytes):
+        if self._decoder is None:
+            return
+        self._decoder.receive_data(data)
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError:
+                # Malformed bodies are left to the form parser of Flask
+                self._decoder = None
+                return
+            if isinstance(event, (NeedData, Epilogue)):
+                return
+            if isinstance(event, File):
+                self._head = b""
+            elif isinstance(event, Field):
+                self._head = None
+            elif isinstance(event, Data) and self._head is not None and len(self._head) < len(PDF_MAGIC):
+                self._head += event.data[:len(PDF_MAGIC) - len(self._head)]
+                if not PDF_MAGIC.startswith(self._head):
+                    raise HttpError(415, "The uploaded file is not a PDF document.")
+
+
+class AsyncServer:
+    def __init__(self, host: str, port: int, threads: int = 4, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # Threads only run the Flask handlers, waiting for print jobs happens on the event loop
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="pex-async")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        global _connections
+        _connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_head(reader), self.timeout)
+                    if request is None:
+                        break
+                    method, target, version, headers = request
+                    body, length = await self._read_body(reader, writer, target, headers)
+                except HttpError as e:
+                    await self._write(writer, f"{e.status} {HTTPStatus(e.status).phrase}", [
+                        ('Content-Type', 'application/json'),
+                        *e.headers,
+                    ], json.dumps({'status': 'error', 'message': str(e), 'details': e.details}).encode(), False)
+                    break
+
+                keep_alive = self._keep_alive(version, headers)
+                try:
+                    status, response_headers, data = await self._dispatch(
+                        writer, method, target, version, headers, body, length
+                    )
+                finally:
+                    body.close()
+                await self._write(writer, status, response_headers, b"" if method == "HEAD" else data, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            _connections -= 1
+            writer.close()
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> tuple[str, str, str, list[tuple[str, str]]] | None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise HttpError(400, "The request is incomplete.")
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "The request headers are too large.")
+
+        lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "The request line is invalid.")
+        if not version.startswith("HTTP/1."):
+            raise HttpError(505, "Only HTTP/1.x is supported.")
+
+        headers = []
+        for line in lines[1:]:
+            name, separator, value = line.partition(":")
+            if not separator:
+                raise HttpError(400, "A request header is invalid.")
+            headers.append((name.strip().lower(), value.strip()))
+        return method.upper(), target, version, headers
+
+    async def _read_body(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, target: str, headers: list[tuple[str, str]]):
+        values = dict(headers)
+        max_size = int(config.get_option("uploads.max_size", 64 * 1024 * 1024) or 0)
+        chunked = "chunked" in values.get("transfer-encoding", "").lower()
+        try:
+            length = int(values.get("content-length", 0) or 0)
+        except ValueError:
+            raise HttpError(400, "The Content-Length header is invalid.")
+        if length < 0:
+            raise HttpError(400, "The Content-Length header is invalid.")
+
+        # Oversized uploads are rejected before reading them, like Flask does with uploads.max_size
+        if max_size and length > max_size:
+            raise HttpError(413, "The request body exceeds the configured maximum upload size.")
+        path, _, query = target.partition("?")
+        path = unquote_to_bytes(path).decode("latin-1")
+        try:
+            server.admit_upload(path, dict(parse_qsl(query)).get('printer'), length)
+        except jobs.QueueFull as e:
+            raise HttpError(429, str(e), {**e.details, 'retry_after': e.retry_after}, [('Retry-After', str(e.retry_after))])
+        check = UploadCheck.create(values.get("content-type", "")) if path in server.UPLOAD_PATHS else None
+        if values.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        body = tempfile.SpooledTemporaryFile(
+            max_size=int(config.get_option("uploads.memory_limit", 4 * 1024 * 1024) or 0),
+            dir=str(spool.get_spool().directory)
+        )
+        try:
+            if chunked:
+                length = 0
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    try:
+                        size = int(line.split(b";", 1)[0].strip(), 16)
+                    except ValueError:
+                        raise HttpError(400, "The chunked request body is invalid.")
+                    if size == 0:
+                        while (await asyncio.wait_for(reader.readline(), self.timeout)).strip():
+                            pass
+                        break
+                    length += size
+                    if max_size and length > max_size:
+                        raise HttpError(413, "The request body exceeds the configured maximum upload size.")
+                    data = await asyncio.wait_for(reader.readexactly(size), self.timeout)
+                    if check is not None:
+                        check.feed(data)
+                    body.write(data)
+                    if await asyncio.wait_for(reader.readexactly(2), self.timeout) != b"\r\n":
+                        raise HttpError(400, "The chunked request body is invalid.")
+            else:
+                remaining = length
+                while remaining > 0:
+                    # Whatever has arrived is taken, so uploads are checked before the rest of the body is there
+                    data = await asyncio.wait_for(reader.read(min(remaining, CHUNK_SIZE)), self.timeout)
+                    if not data:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    if check is not None:
+                        check.feed(data)
+                    body.write(data)
+                    remaining -= len(data)
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body, length
+
+    @staticmethod
+    def _keep_alive(version: str, headers: list[tuple[str, str]]) -> bool:
+        connection = dict(headers).get("connection", "").lower()
+        if version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+    def _environ(self, writer: asyncio.StreamWriter, method: str, target: str, version: str, headers, body, length: int) -> dict:
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode("latin-1"),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': str(peer[0]),
+            'REMOTE_PORT': str(peer[1]),
+            'CONTENT_LENGTH': str(length) if length else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            if name in ("content-length", "transfer-encoding"):
+                continue
+            key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def _call_app(self, environ: dict) -> tuple[str, list[tuple[str, str]], bytes]:
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        result = server.app(environ, start_response)
+        try:
+            data = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response['status'], response['headers'], data
+
+    async def _dispatch(self, writer, method, target, version, headers, body, length):
+        loop = asyncio.get_running_loop()
+        deferred = []
+        environ = self._environ(writer, method, target, version, headers, body, length)
+        environ['pex.defer'] = lambda waiting, timeout, finish: deferred.append((waiting, timeout, finish))
+
+        result = await loop.run_in_executor(self.executor, self._call_app, environ)
+        if not deferred:
+            return result
+
+        # Requests with "wait" park here without a thread until their jobs are done
+        waiting, timeout, finish = deferred[0]
+        try:
+            await asyncio.wait_for(asyncio.gather(*[self._finished(loop, job) for job in waiting]), timeout)
+        except asyncio.TimeoutError:
+            pass
+        response = await loop.run_in_executor(self.executor, finish)
+        try:
+            return response.status, response.headers.to_wsgi_list(), response.get_data()
+        finally:
+            response.close()
+
+    @staticmethod
+    def _finished(loop: asyncio.AbstractEventLoop, job: jobs.Job) -> asyncio.Future:
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(job)
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(resolve))
+        return future
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, status: str, headers: list[tuple[str, str]], data: bytes, keep_alive: bool):
+        lines = [f"HTTP/1.1 {status}"]
+        for name, value in headers:
+            if name.lower() not in ("connection", "content-length", "date", "server"):
+                lines.append(f"{name}: {value}")
+        lines.append(f"Content-Length: {len(data)}")
+        lines.append(f"Date: {formatdate(usegmt=True)}")
+        lines.append(f"Server: PEX/{__VERSION__}")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+
+async def _serve(host: str, port: int, threads: int, backlog: int, timeout: float, sock: socket.socket | None = None):
+    async_server = AsyncServer(host, port, threads, timeout)
+    if sock is not None:
+        listener = await asyncio.start_server(async_server.handle, sock=sock, limit=MAX_HEADER_SIZE)
+    else:
+        listener = await asyncio.start_server(async_server.handle, host, port, backlog=backlog, limit=MAX_HEADER_SIZE)
+    print(f"Serving on http://{host}:{port} (asyncio)")
+    async with listener:
+        await listener.serve_forever()
+
+
+def run(sock: socket.socket | None = None, recover: dict | None = None):
+    if sock is None and server.supervise(run):
+        return
+    host = config.get_option("server.host") or "0.0.0.0"
+    port = int(config.get_option("server.port") or 4422)
+    threads = int(config.get_option("server.threads") or 4)
+    backlog = int(config.get_option("server.backlog") or 128)
+    timeout = float(config.get_option("server.timeout") or 30)
+    server.prepare(recover)
+    try:
+        asyncio.run(_serve(host, port, threads, backlog, timeout, sock))
+    except KeyboardInterrupt:
+        pass
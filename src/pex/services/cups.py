@@ -0,0 +1,497 @@
+import getpass
+import http.client
+import os
+import queue
+import re
+import socket
+import struct
+import subprocess
+import threading
+from typing import Iterator
+from urllib.parse import quote, urlsplit
+from . import spool
+from .documents import Document
+from .. import config
+
+IPP_PRINT_JOB = 0x0002
+IPP_CREATE_JOB = 0x0005
+IPP_SEND_DOCUMENT = 0x0006
+IPP_CANCEL_JOB = 0x0008
+IPP_GET_JOBS = 0x000A
+IPP_GET_PRINTER_ATTRIBUTES = 0x000B
+CUPS_GET_PRINTERS = 0x4002
+
+TAG_OPERATION = 0x01
+TAG_JOB = 0x02
+TAG_END = 0x03
+TAG_PRINTER = 0x04
+
+TAG_INTEGER = 0x21
+TAG_BOOLEAN = 0x22
+TAG_ENUM = 0x23
+TAG_RANGE = 0x33
+TAG_TEXT = 0x41
+TAG_NAME = 0x42
+TAG_KEYWORD = 0x44
+TAG_URI = 0x45
+TAG_CHARSET = 0x47
+TAG_LANGUAGE = 0x48
+TAG_MIME_TYPE = 0x49
+
+CUPS_SOCKETS = ("/run/cups/cups.sock", "/var/run/cups/cups.sock")
+
+
+class IPPError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class IPPConnectionError(ConnectionError):
+    pass
+
+
+def _encode_attribute(tag: int, name: str, values) -> bytes:
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+
+    out = bytearray()
+    for i, value in enumerate(values):
+        if tag in (TAG_INTEGER, TAG_ENUM):
+            raw = struct.pack(">i", int(value))
+        elif tag == TAG_BOOLEAN:
+            raw = b"\x01" if value else b"\x00"
+        else:
+            raw = str(value).encode("utf-8")
+        key = name.encode("utf-8") if i == 0 else b""
+        out += struct.pack(">BH", tag, len(key)) + key + struct.pack(">H", len(raw)) + raw
+    return bytes(out)
+
+
+def _decode_value(tag: int, raw: bytes):
+    if tag in (TAG_INTEGER, TAG_ENUM) and len(raw) == 4:
+        return struct.unpack(">i", raw)[0]
+    if tag == TAG_BOOLEAN and len(raw) == 1:
+        return raw != b"\x00"
+    if tag == TAG_RANGE and len(raw) == 8:
+        return struct.unpack(">ii", raw)
+    if 0x40 <= tag <= 0x4F:
+        return raw.decode("utf-8", "replace")
+    return raw
+
+
+def encode_request(operation: int, request_id: int, groups: list[tuple[int, list[tuple[int, str, object]]]]) -> bytes:
+    out = bytearray(struct.pack(">BBHI", 2, 0, operation, request_id))
+    for group_tag, attributes in groups:
+        out.append(group_tag)
+        for tag, name, values in attributes:
+            out += _encode_attribute(tag, name, values)
+    out.append(TAG_END)
+    return bytes(out)
+
+
+def decode_response(data: bytes) -> tuple[int, int, list[tuple[int, dict]]]:
+    if len(data) < 9:
+        raise IPPError(0x0500, "The IPP response is truncated.")
+    _, _, status, request_id = struct.unpack(">BBHI", data[:8])
+    pos = 8
+    groups: list[tuple[int, dict]] = []
+    current: dict = {}
+    last_name = None
+
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        if tag == TAG_END:
+            break
+        if tag < 0x10:
+            current = {}
+            groups.append((tag, current))
+            continue
+        name_length = struct.unpack(">H", data[pos:pos + 2])[0]
+        pos += 2
+        name = data[pos:pos + name_length].decode("utf-8", "replace")
+        pos += name_length
+        value_length = struct.unpack(">H", data[pos:pos + 2])[0]
+        pos += 2
+        value = _decode_value(tag, data[pos:pos + value_length])
+        pos += value_length
+
+        if name:
+            last_name = name
+            current[name] = [value]
+        elif last_name is not None:
+            current.setdefault(last_name, []).append(value)
+    return status, request_id, groups
+
+
+def _format_job_id(printer: str, job_id: int) -> str:
+    return f"{printer}-{job_id}"
+
+
+def _parse_job_id(job_id: str) -> tuple[str, int]:
+    m = re.match(r"^(.*)-(\d+)$", job_id or "")
+    if not m:
+        raise ValueError(f"Invalid CUPS job id '{job_id}'.")
+    return m.group(1), int(m.group(2))
+
+
+class LpBackend:
+    name = "lp"
+
+    def submit(self, documents: Document | list[Document], printer: str, copies: int = 1, options: dict | None = None) -> str | None:
+        documents = [documents] if isinstance(documents, Document) else list(documents)
+        cmd = ["lp", "-d", printer]
+        if copies > 1:
+            cmd += ["-n", str(copies)]
+        for key, value in (options or {}).items():
+            cmd += ["-o", f"{key}={value}"]
+
+        # Single in-memory documents are streamed to lp via stdin, everything else is passed by path
+        if len(documents) == 1 and documents[0].in_memory:
+            proc = subprocess.Popen(
+                cmd + ["-t", documents[0].name],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            try:
+                for chunk in documents[0].chunks():
+                    proc.stdin.write(chunk)
+            except BrokenPipeError:
+                pass
+            out, err = proc.communicate()
+            returncode = proc.returncode
+        else:
+            with spool.get_spool().files(documents) as (paths, fds):
+                res = subprocess.run(cmd + paths, capture_output=True, pass_fds=fds)
+            out, err, returncode = res.stdout, res.stderr, res.returncode
+
+        out = (out or b"").decode("utf-8", "replace")
+        err = (err or b"").decode("utf-8", "replace")
+        if returncode != 0:
+            raise RuntimeError(err.strip() or out.strip() or "The lp command failed.")
+        m = re.search(r"request id is (\S+-\d+)", out)
+        return m.group(1) if m else None
+
+    def active_jobs(self, printer: str) -> set[str]:
+        res = subprocess.run(["lpstat", "-W", "not-completed", "-o", printer], capture_output=True, text=True)
+        return {line.split()[0] for line in (res.stdout or "").splitlines() if line.strip()}
+
+    def cancel(self, job_id: str) -> bool:
+        res = subprocess.run(["cancel", job_id], capture_output=True, text=True)
+        return res.returncode == 0
+
+    def list_printers(self) -> list[str]:
+        res = subprocess.run(["lpstat", "-e"], capture_output=True, text=True, timeout=3)
+        if res.returncode != 0:
+            return []
+        return [line.strip() for line in res.stdout.splitlines() if line.strip()]
+
+    def supports_copies(self, printer: str) -> bool:
+        try:
+            out = subprocess.check_output(
+                ["lpoptions", "-p", printer, "-l"],
+                stderr=subprocess.STDOUT,
+                text=True,
+                timeout=3
+            )
+            return "copies" in out.lower()
+        except Exception:
+            return False
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class IppBackend:
+    name = "ipp"
+
+    def __init__(self, uri: str | None = None, timeout: float = 10.0, connections: int = 4, fallback=None):
+        self.uri = uri or self._default_uri()
+        self.timeout = timeout
+        self.fallback = fallback
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=max(1, connections))
+        self._request_id = 0
+        self._lock = threading.Lock()
+        self._user = self._username()
+
+    @staticmethod
+    def _default_uri() -> str:
+        server = os.environ.get("CUPS_SERVER")
+        if server:
+            return server if server.startswith("/") or "://" in server else f"http://{server}"
+        for path in CUPS_SOCKETS:
+            if os.path.exists(path):
+                return path
+        return "http://localhost:631"
+
+    @staticmethod
+    def _username() -> str:
+        try:
+            return getpass.getuser()
+        except Exception:
+            return "pex"
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.uri.startswith("/"):
+            return _UnixHTTPConnection(self.uri, self.timeout)
+        parts = urlsplit(self.uri if "://" in self.uri else f"http://{self.uri}")
+        return http.client.HTTPConnection(parts.hostname or "localhost", parts.port or 631, timeout=self.timeout)
+
+    def _next_request_id(self) -> int:
+        with self._lock:
+            self._request_id = (self._request_id % 0x7FFFFFFF) + 1
+            return self._request_id
+
+    @staticmethod
+    def _alive(conn: http.client.HTTPConnection) -> bool:
+        # Idle keep-alive connections closed by CUPS are readable (EOF), live ones have nothing to read
+        if conn.sock is None:
+            return False
+        try:
+            conn.sock.setblocking(False)
+            try:
+                return conn.sock.recv(1, socket.MSG_PEEK) != b""
+            finally:
+                conn.sock.settimeout(conn.timeout)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _acquire(self) -> tuple[http.client.HTTPConnection, bool]:
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if self._alive(conn):
+                return conn, True
+            conn.close()
+
+        conn = self._connect()
+        try:
+            conn.connect()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise IPPConnectionError(f"The connection to CUPS failed: {e}") from e
+        return conn, False
+
+    def _post(self, resource: str, body: bytes, document: Document | None = None) -> bytes:
+        headers = {"Content-Type": "application/ipp"}
+        length = len(body) + (document.size if document else 0)
+        headers["Content-Length"] = str(length)
+        sent = False
+
+        def payload() -> Iterator[bytes]:
+            nonlocal sent
+            yield body
+            sent = True
+            yield from document.chunks()
+
+        # Requests are only retried (or handed to the fallback) while nothing could have been processed by CUPS,
+        # a print operation whose document has been written is never sent twice
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            try:
+                conn.request("POST", resource, body=payload() if document else body, headers=headers)
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if sent:
+                    raise
+                if reused and attempt == 0:
+                    continue
+                raise IPPConnectionError(f"The request to CUPS could not be sent: {e}") from e
+
+            if resp.will_close:
+                conn.close()
+            else:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            if resp.status != 200:
+                raise IPPError(0x0500, f"CUPS responded with HTTP {resp.status} {resp.reason}.")
+            return data
+        raise IPPConnectionError("The connection to CUPS failed.")
+
+    def _operation(self, operation: int, resource: str, printer: str | None = None, attributes=None, job=None, document: Document | None = None):
+        operation_attributes = [
+            (TAG_CHARSET, "attributes-charset", "utf-8"),
+            (TAG_LANGUAGE, "attributes-natural-language", "en"),
+        ]
+        if printer is not None:
+            operation_attributes.append((TAG_URI, "printer-uri", f"ipp://localhost/printers/{quote(printer)}"))
+        operation_attributes.append((TAG_NAME, "requesting-user-name", self._user))
+        operation_attributes += attributes or []
+
+        groups = [(TAG_OPERATION, operation_attributes)]
+        if job:
+            groups.append((TAG_JOB, job))
+
+        data = self._post(resource, encode_request(operation, self._next_request_id(), groups), document)
+        status, _, response_groups = decode_response(data)
+        if status >= 0x0400:
+            message = next((
+                attrs["status-message"][0] for tag, attrs in response_groups
+                if tag == TAG_OPERATION and "status-message" in attrs
+            ), f"The IPP request failed with status 0x{status:04x}.")
+            raise IPPError(status, message)
+        return response_groups
+
+    def _with_fallback(self, method: str, *args):
+        try:
+            return getattr(self, f"_ipp_{method}")(*args)
+        except IPPConnectionError:
+            if self.fallback is None:
+                raise
+            return getattr(self.fallback, method)(*args)
+
+    def submit(self, documents: Document | list[Document], printer: str, copies: int = 1, options: dict | None = None) -> str | None:
+        return self._with_fallback("submit", documents, printer, copies, options)
+
+    def active_jobs(self, printer: str) -> set[str]:
+        return self._with_fallback("active_jobs", printer)
+
+    def cancel(self, job_id: str) -> bool:
+        return self._with_fallback("cancel", job_id)
+
+    def list_printers(self) -> list[str]:
+        return self._with_fallback("list_printers")
+
+    def supports_copies(self, printer: str) -> bool:
+        return self._with_fallback("supports_copies", printer)
+
+    def printer_attributes(self, printer: str, names: list[str] | None = None) -> dict:
+        attributes = [(TAG_KEYWORD, "requested-attributes", names)] if names else []
+        groups = self._operation(IPP_GET_PRINTER_ATTRIBUTES, f"/printers/{quote(printer)}", printer, attributes)
+        return next((attrs for tag, attrs in groups if tag == TAG_PRINTER), {})
+
+    def _ipp_submit(self, documents: Document | list[Document], printer: str, copies: int = 1, options: dict | None = None) -> str | None:
+        documents = [documents] if isinstance(documents, Document) else list(documents)
+        options = dict(options or {})
+        if "copies" in options:
+            copies = int(options.pop("copies"))
+
+        job = []
+        if copies > 1:
+            job.append((TAG_INTEGER, "copies", copies))
+        collate = str(options.pop("Collate", "")).lower()
+        if collate in ("true", "false"):
+            job.append((TAG_KEYWORD, "multiple-document-handling", (
+                "separate-documents-collated-copies" if collate == "true" else "separate-documents-uncollated-copies"
+            )))
+        for key, value in options.items():
+            if isinstance(value, bool) or str(value).lower() in ("true", "false"):
+                job.append((TAG_BOOLEAN, key, value if isinstance(value, bool) else str(value).lower() == "true"))
+            elif isinstance(value, int) or str(value).isdigit():
+                job.append((TAG_INTEGER, key, int(value)))
+            else:
+                job.append((TAG_KEYWORD, key, str(value)))
+
+        resource = f"/printers/{quote(printer)}"
+        job_name = (TAG_NAME, "job-name", documents[0].name)
+        document_format = (TAG_MIME_TYPE, "document-format", "application/octet-stream")
+        if len(documents) == 1:
+            groups = self._operation(IPP_PRINT_JOB, resource, printer, [job_name, document_format], job, document=documents[0])
+            return self._job_id(printer, groups)
+
+        # Multiple documents are sent as one job, using Create-Job + Send-Document
+        job_id = self._job_id(printer, self._operation(IPP_CREATE_JOB, resource, printer, [job_name], job))
+        if job_id is None:
+            raise IPPError(0x0500, "CUPS did not return a job id for Create-Job.")
+        _, number = _parse_job_id(job_id)
+        try:
+            for i, document in enumerate(documents):
+                self._operation(IPP_SEND_DOCUMENT, resource, printer, [
+                    (TAG_INTEGER, "job-id", number),
+                    document_format,
+                    (TAG_BOOLEAN, "last-document", i == len(documents) - 1),
+                ], document=document)
+        except Exception as e:
+            # The job exists in CUPS already, it is cancelled (instead of holding the queue or printing the
+            # documents again with lp) whether the connection failed or CUPS rejected a document
+            try:
+                self._ipp_cancel(job_id)
+            except (OSError, http.client.HTTPException, IPPError):
+                pass
+            if isinstance(e, IPPError):
+                raise
+            raise IPPError(0x0500, f"Sending the documents of job {job_id} failed: {e}") from e
+        return job_id
+
+    @staticmethod
+    def _job_id(printer: str, groups: list[tuple[int, dict]]) -> str | None:
+        for tag, attrs in groups:
+            if tag == TAG_JOB and attrs.get("job-id"):
+                return _format_job_id(printer, attrs["job-id"][0])
+        return None
+
+    def _ipp_active_jobs(self, printer: str) -> set[str]:
+        groups = self._operation(IPP_GET_JOBS, f"/printers/{quote(printer)}", printer, [
+            (TAG_KEYWORD, "which-jobs", "not-completed"),
+            (TAG_KEYWORD, "requested-attributes", ["job-id"]),
+        ])
+        return {_format_job_id(printer, attrs["job-id"][0]) for tag, attrs in groups if tag == TAG_JOB and attrs.get("job-id")}
+
+    def _ipp_cancel(self, job_id: str) -> bool:
+        printer, number = _parse_job_id(job_id)
+        try:
+            self._operation(IPP_CANCEL_JOB, f"/printers/{quote(printer)}", printer, [(TAG_INTEGER, "job-id", number)])
+        except IPPError:
+            return False
+        return True
+
+    def _ipp_list_printers(self) -> list[str]:
+        groups = self._operation(CUPS_GET_PRINTERS, "/", None, [
+            (TAG_KEYWORD, "requested-attributes", ["printer-name"]),
+        ])
+        return [attrs["printer-name"][0] for tag, attrs in groups if tag == TAG_PRINTER and attrs.get("printer-name")]
+
+    def _ipp_supports_copies(self, printer: str) -> bool:
+        attrs = self.printer_attributes(printer, ["copies-supported"])
+        supported = (attrs.get("copies-supported") or [None])[0]
+        return isinstance(supported, tuple) and supported[1] > 1
+
+
+_backend = None
+_backend_key = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend, _backend_key
+    name = str(config.get_option("cups.backend", "lp") or "lp").lower()
+    uri = config.get_option("cups.uri", None)
+    key = (name, uri)
+
+    with _backend_lock:
+        if _backend is None or _backend_key != key:
+            if name == "ipp":
+                _backend = IppBackend(
+                    uri,
+                    timeout=float(config.get_option("cups.timeout", 10) or 10),
+                    connections=int(config.get_option("cups.connections", 4) or 4),
+                    fallback=LpBackend(),
+                )
+            else:
+                _backend = LpBackend()
+            _backend_key = key
+        return _backend
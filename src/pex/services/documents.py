@@ -0,0 +1,334 @@
+import hashlib
+import io
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator
+from .. import config
+
+if sys.platform != "win32":
+    import fcntl
+
+ROOT_PATH = Path(__file__).resolve().parents[3]
+STORE_PATH = ROOT_PATH / "temp" / "documents"
+
+CHUNK_SIZE = 64 * 1024
+PDF_MAGIC = b"%PDF"
+PDF_PAGE_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+class SpoolStream(tempfile.SpooledTemporaryFile):
+    def __init__(self, max_size: int = 0, directory: str | None = None, require_pdf: bool = False):
+        super().__init__(max_size=max_size, mode="w+b", dir=directory)
+        self.require_pdf = require_pdf
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._head = b""
+
+    def write(self, data) -> int:
+        # Reject non-PDF uploads on the first bytes, before the rest of the body gets buffered
+        if self.require_pdf and len(self._head) < len(PDF_MAGIC):
+            self._head += bytes(data[:len(PDF_MAGIC) - len(self._head)])
+            if not PDF_MAGIC.startswith(self._head):
+                raise UnsupportedDocument("The uploaded file is not a PDF document.")
+        written = super().write(data)
+        self.sha256.update(data)
+        self.size += written
+        return written
+
+
+class Document:
+    def __init__(
+        self,
+        name: str,
+        stream: BinaryIO | None = None,
+        size: int = 0,
+        path: str | None = None,
+        temporary: bool = False,
+        digest: str | None = None,
+        release: Callable[[], None] | None = None
+    ):
+        self.name = name
+        self.size = size
+        self.path = path
+        self.temporary = temporary
+        self.digest = digest
+        # Called once on close, documents of the store use it to unpin their file
+        self.release = release
+        self._stream = stream
+
+    @classmethod
+    def from_bytes(cls, name: str, data: bytes) -> "Document":
+        return cls(name, io.BytesIO(data), len(data), digest=hashlib.sha256(data).hexdigest())
+
+    @classmethod
+    def from_path(cls, path: str, temporary: bool = False) -> "Document":
+        return cls(os.path.basename(path), None, os.path.getsize(path), path, temporary)
+
+    @classmethod
+    def from_stream(cls, name: str, stream: SpoolStream) -> "Document":
+        stream.seek(0)
+        return cls(name, stream, stream.size, digest=stream.sha256.hexdigest())
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+    def head(self, length: int = len(PDF_MAGIC)) -> bytes:
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                return f.read(length)
+        self._stream.seek(0)
+        return self._stream.read(length)
+
+    def tail(self, length: int) -> bytes:
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                f.seek(max(0, self.size - length))
+                return f.read(length)
+        self._stream.seek(max(0, self.size - length))
+        return self._stream.read(length)
+
+    def page_count(self) -> int | None:
+        # The page tree root is usually near the start or, for incremental updates, near the end of the file
+        data = self.head(CHUNK_SIZE)
+        if self.size > CHUNK_SIZE:
+            data += self.tail(min(CHUNK_SIZE, self.size - CHUNK_SIZE))
+        counts = [int(a or b) for a, b in PDF_PAGE_COUNT.findall(data)]
+        return max(counts) if counts else None
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    yield chunk
+            return
+        self._stream.seek(0)
+        while chunk := self._stream.read(chunk_size):
+            yield chunk
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        release, self.release = self.release, None
+        if release is not None:
+            release()
+
+
+class DocumentStore:
+    def __init__(self, directory: str | Path, max_size: int):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        # Pinned documents are used by jobs and never evicted, digest -> [references, locked file descriptor]
+        self._pins: dict[str, list] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._evict()
+
+    def _load(self):
+        # All server workers share the directory, so the view of this process is rebuilt from the disk
+        found = []
+        for entry in os.scandir(self.directory):
+            name, ext = os.path.splitext(entry.name)
+            if ext != ".pdf" or not SHA256_PATTERN.match(name):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        self._entries = OrderedDict((digest, size) for _, digest, size in sorted(found))
+        self._size = sum(size for _, _, size in found)
+
+    def path(self, digest: str) -> str:
+        return str(self.directory / f"{digest}.pdf")
+
+    def _touch(self, digest: str):
+        self._entries.move_to_end(digest)
+        try:
+            os.utime(self.path(digest))
+        except OSError:
+            pass
+
+    def _adopt(self, digest: str) -> int | None:
+        # Documents stored by another worker are picked up from the disk
+        size = self._entries.get(digest)
+        if size is None:
+            try:
+                size = os.path.getsize(self.path(digest))
+            except OSError:
+                return None
+            self._entries[digest] = size
+            self._size += size
+        return size
+
+    def _pin(self, digest: str) -> bool:
+        pin = self._pins.get(digest)
+        if pin is not None:
+            pin[0] += 1
+            return True
+
+        fd = None
+        if sys.platform == "win32":
+            if not os.path.exists(self.path(digest)):
+                return False
+        else:
+            # The shared lock keeps the evictions of every worker away from the file
+            try:
+                fd = os.open(self.path(digest), os.O_RDONLY)
+            except FileNotFoundError:
+                return False
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                current = os.path.samestat(os.fstat(fd), os.stat(self.path(digest)))
+            except FileNotFoundError:
+                current = False
+            if not current:
+                os.close(fd)
+                return False
+        self._pins[digest] = [1, fd]
+        return True
+
+    def unpin(self, digest: str):
+        with self._lock:
+            pin = self._pins.get(digest)
+            if pin is None:
+                return
+            pin[0] -= 1
+            if pin[0] <= 0:
+                del self._pins[digest]
+                if pin[1] is not None:
+                    os.close(pin[1])
+
+    def hold(self, document: Document) -> bool:
+        # The file of the document is pinned until the document is closed
+        if document.release is None and document.digest:
+            digest = document.digest
+            with self._lock:
+                pinned = self._pin(digest)
+            if pinned:
+                document.release = lambda: self.unpin(digest)
+        return document.release is not None
+
+    def contains(self, digest: str) -> int | None:
+        with self._lock:
+            size = self._adopt(digest)
+            if size is not None:
+                self._touch(digest)
+            return size
+
+    def get(self, digest: str, name: str | None = None) -> Document | None:
+        with self._lock:
+            if not self._pin(digest):
+                self._size -= self._entries.pop(digest, 0)
+                self.misses += 1
+                return None
+            size = self._adopt(digest)
+            self._touch(digest)
+            self.hits += 1
+        return Document(name or f"{digest}.pdf", None, size, self.path(digest), digest=digest, release=lambda: self.unpin(digest))
+
+    def put(self, document: Document) -> bool:
+        digest = document.digest
+        if not digest or document.size > self.max_size:
+            return False
+        with self._lock:
+            if self._adopt(digest) is not None:
+                self._touch(digest)
+                return True
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in document.chunks():
+                    f.write(chunk)
+            os.replace(tmp_path, self.path(digest))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._evict()
+        return True
+
+    def _remove(self, digest: str) -> bool:
+        path = self.path(digest)
+        if sys.platform == "win32":
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                return False
+            return True
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True
+        try:
+            # Documents pinned by a job of any worker hold a shared lock
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+        return True
+
+    def _evict(self):
+        self._load()
+        for digest, size in list(self._entries.items()):
+            if self._size <= self.max_size:
+                break
+            if digest in self._pins or not self._remove(digest):
+                continue
+            del self._entries[digest]
+            self._size -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'documents': len(self._entries),
+                'size': self._size,
+                'max_size': self.max_size,
+                'pinned': len(self._pins),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_store: DocumentStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> DocumentStore | None:
+    global _store
+    max_size = int(config.get_option("documents.max_size", 256 * 1024 * 1024) or 0)
+    if max_size <= 0:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore(STORE_PATH, max_size)
+        _store.max_size = max_size
+        return _store
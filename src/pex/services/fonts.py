@@ -0,0 +1,208 @@
+import copy
+import io
+import threading
+import time
+from fontTools import ttLib
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap, TTFFont
+from pathlib import Path
+from .. import config
+
+ROOT_PATH = Path(__file__).resolve().parents[3]
+FONT_STYLES = ("", "B", "I", "BI")
+
+
+class FontMetrics:
+    def __init__(self, family: str, style: str, size: float, max_words: int = 4096):
+        self.family = family
+        self.style = style
+        self.size = size
+        self.max_words = max_words
+        self._chars: dict[str, float] = {}
+        self._words: dict[str, float] = {}
+
+    def char_width(self, pdf: FPDF, char: str) -> float:
+        width = self._chars.get(char)
+        if width is None:
+            # Widths are kept in points, so they are independent of the document unit
+            width = self._chars[char] = pdf.get_string_width(char) * pdf.k
+        return width
+
+    def width(self, pdf: FPDF, text: str) -> float:
+        width = self._words.get(text)
+        if width is None:
+            chars = self._chars
+            width = 0.0
+            for char in text:
+                w = chars.get(char)
+                width += w if w is not None else self.char_width(pdf, char)
+            if len(self._words) >= self.max_words:
+                self._words.clear()
+            self._words[text] = width
+        return width / pdf.k
+
+
+_metrics: dict[tuple[str, str, float], FontMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(family: str, style: str, size: float) -> FontMetrics:
+    # Underline and strikethrough do not change the glyph widths
+    style = "".join(s for s in "BI" if s in style.upper())
+    key = (family.lower(), style, float(size))
+    metrics = _metrics.get(key)
+    if metrics is None:
+        with _metrics_lock:
+            metrics = _metrics.get(key)
+            if metrics is None:
+                metrics = _metrics[key] = FontMetrics(key[0], style, key[2])
+    return metrics
+
+
+class _LoadedFont:
+    def __init__(self, path: Path, font: TTFFont, data: bytes, load_time: float):
+        self.path = path
+        self.font = font
+        self.data = data
+        self.load_time = load_time
+        # Compressed, color and CID-keyed fonts (and fonts fpdf2 has to add a .notdef glyph to) are added per document
+        self.shared = (
+            not font.is_compressed and font.color_font is None and not (font.is_cff and font.is_cid_keyed)
+            and ".notdef" in self._open().getGlyphOrder()
+        )
+
+    def _open(self) -> ttLib.TTFont:
+        return ttLib.TTFont(io.BytesIO(self.data), recalcTimestamp=False, lazy=True)
+
+    def copy(self, pdf: FPDF) -> TTFFont:
+        # Relies on the TTFFont internals of fpdf2 2.8 (pinned): documents share the parsed glyph metrics, while
+        # the subset state and the font file (which is subset in place on output) belong to each document
+        font = copy.copy(self.font)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = self._open()
+        font._hbfont = None
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font.subset = SubsetMap(font)
+        return font
+
+
+class FontRegistry:
+    def __init__(self):
+        self.version = 0
+        self._spec = None
+        self._snapshot = None
+        self._fonts: dict[str, _LoadedFont] = {}
+        self._errors: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _resolve(path: str) -> Path:
+        path = Path(path).expanduser()
+        return path if path.is_absolute() else ROOT_PATH / path
+
+    @staticmethod
+    def _styles(spec) -> dict[str, str]:
+        if isinstance(spec, str):
+            return {"": spec}
+        if not isinstance(spec, dict):
+            raise ValueError("The font must be a path or an object with 'path' and 'styles'.")
+        styles = {"": spec["path"]} if spec.get("path") else {}
+        for style, path in (spec.get("styles") or {}).items():
+            style = "".join(sorted(str(style).upper()))
+            if style not in FONT_STYLES:
+                raise ValueError(f"Unknown font style '{style}' (use 'B', 'I' or 'BI').")
+            styles[style] = path
+        if not styles:
+            raise ValueError("The font requires at least one 'path'.")
+        return styles
+
+    def _parse(self, alias: str, style: str, path: Path) -> _LoadedFont:
+        # Fonts are parsed once on load, so broken font files are reported on /pex/status instead of failing jobs
+        start = time.perf_counter()
+        data = path.read_bytes()
+        scratch = FPDF()
+        scratch.add_font(alias, style, str(path))
+        return _LoadedFont(path, scratch.fonts[f"{alias}{style}"], data, time.perf_counter() - start)
+
+    def load(self, force: bool = False):
+        snapshot = config.get_snapshot()
+        if not force and snapshot is self._snapshot:
+            return
+        spec = snapshot.get("fonts", {}) or {}
+        with self._lock:
+            self._snapshot = snapshot
+            if not force and self._spec == spec:
+                return
+            fonts: dict[str, _LoadedFont] = {}
+            errors: dict[str, str] = {}
+            for alias, font_spec in spec.items():
+                alias = str(alias).lower()
+                try:
+                    for style, path in self._styles(font_spec).items():
+                        fonts[f"{alias}{style}"] = self._parse(alias, style, self._resolve(path))
+                except Exception as e:
+                    errors[alias] = str(e)
+            self._spec = spec
+            self._fonts = fonts
+            self._errors = errors
+            self.version += 1
+            with _metrics_lock:
+                _metrics.clear()
+
+    def fontkey(self, family: str, style: str) -> str | None:
+        self.load()
+        family = family.lower()
+        style = "".join(s for s in "BI" if s in style.upper())
+        for candidate in (style, style[:1], style[1:], ""):
+            if f"{family}{candidate}" in self._fonts:
+                return f"{family}{candidate}"
+        return None
+
+    def install(self, pdf: FPDF, family: str, style: str):
+        fontkey = f"{family}{style}"
+        if fontkey in pdf.fonts:
+            return
+        loaded = self._fonts[fontkey]
+        if loaded.shared:
+            pdf.fonts[fontkey] = loaded.copy(pdf)
+        else:
+            pdf.add_font(family, style, str(loaded.path))
+
+    def stats(self) -> dict:
+        self.load()
+        with self._lock:
+            return {
+                'fonts': {
+                    fontkey: {
+                        'path': str(loaded.path),
+                        'glyphs': len(loaded.font.cmap),
+                        'load_time': round(loaded.load_time, 4),
+                    } for fontkey, loaded in self._fonts.items()
+                },
+                'errors': dict(self._errors),
+            }
+
+
+_registry: FontRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> FontRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FontRegistry()
+        return _registry
+
+
+def set_font(pdf: FPDF, family: str, style: str, size: float) -> FontMetrics:
+    registry = get_registry()
+    fontkey = registry.fontkey(family, style)
+    if fontkey is not None:
+        # Missing styles fall back to the closest registered style, underline and strikethrough still apply
+        family = family.lower()
+        registry.install(pdf, family, fontkey[len(family):])
+        style = fontkey[len(family):] + "".join(s for s in "US" if s in style.upper())
+    pdf.set_font(family, style=style, size=size)
+    return get_metrics(pdf.font_family, style, size)
@@ -0,0 +1,80 @@
+import threading
+import time
+from typing import Callable
+
+
+class PrinterInventory:
+    def __init__(self, query: Callable[[], list[str]], ttl: float = 30.0, miss_interval: float = 1.0):
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self._query = query
+        self._printers: tuple[str, ...] = ()
+        self._names: frozenset[str] = frozenset()
+        self._loaded = False
+        self._updated_at = 0.0
+        self._forced_at = 0.0
+        self._refreshes = 0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self.ttl <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="pex-inventory", daemon=True)
+            self._thread.start()
+
+    def refresh(self) -> tuple[str, ...]:
+        with self._lock:
+            try:
+                printers = sorted(self._query(), key=lambda s: s.lower())
+            except Exception:
+                if self._loaded:
+                    return self._printers
+                printers = []
+            self._printers = tuple(printers)
+            self._names = frozenset(printers)
+            self._loaded = True
+            self._updated_at = time.monotonic()
+            self._refreshes += 1
+            return self._printers
+
+    def printers(self, refresh: bool = False) -> list[str]:
+        if refresh or self.ttl <= 0:
+            return list(self.refresh())
+        if not self._loaded:
+            self.refresh()
+        self.start()
+        return list(self._printers)
+
+    def exists(self, name: str) -> bool:
+        if self.ttl <= 0:
+            return name in self.refresh()
+        if not self._loaded:
+            self.refresh()
+        self.start()
+        if name in self._names:
+            return True
+
+        # Force a refresh on misses, so newly added printers are found without waiting for the TTL
+        now = time.monotonic()
+        if now - self._forced_at < self.miss_interval:
+            return False
+        self._forced_at = now
+        self.refresh()
+        return name in self._names
+
+    def stats(self) -> dict:
+        return {
+            'printers': len(self._printers),
+            'ttl': self.ttl,
+            'age': round(time.monotonic() - self._updated_at, 3) if self._loaded else None,
+            'refreshes': self._refreshes,
+        }
+
+    def _run(self):
+        while True:
+            time.sleep(self.ttl)
+            self.refresh()
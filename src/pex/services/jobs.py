@@ -0,0 +1,789 @@
+import hashlib
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Tuple, Union
+from . import documents, labels, metrics, printer
+from .cache import canonical_hash
+from .documents import Document
+from .jobstore import JobStore
+from .. import config
+
+if sys.platform != "win32":
+    import fcntl
+
+JOB_QUEUED = "queued"
+JOB_RENDERING = "rendering"
+JOB_SPOOLING = "spooling"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_STATES = (JOB_QUEUED, JOB_RENDERING, JOB_SPOOLING, JOB_DONE, JOB_FAILED)
+JOB_FINAL_STATES = (JOB_DONE, JOB_FAILED)
+
+ROOT_PATH = Path(__file__).resolve().parents[3]
+STORE_FILE = ROOT_PATH / "temp" / "jobs.sqlite3"
+LOCK_PATH = ROOT_PATH / "temp" / "locks"
+
+PRIORITY_RANGE = (-10, 10)
+BYTES_PER_PAGE = 100 * 1024
+LINES_PER_PAGE = 10
+DRAIN_WINDOW = 50
+RETRY_AFTER_RANGE = (1, 300)
+
+
+class QueueFull(Exception):
+    def __init__(self, message: str, printer_name: str, retry_after: int, details: dict):
+        super().__init__(message)
+        self.printer = printer_name
+        self.retry_after = retry_after
+        self.details = details
+
+
+class Job:
+    def __init__(
+        self,
+        kind: str,
+        printer_name: str,
+        task: Callable[["Job"], "printer.Submission | None"] | None,
+        payload: dict | None = None,
+        job_id: str | None = None,
+        created_at: float | None = None,
+        priority: int = 0,
+        cost: float = 1.0
+    ):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.printer = printer_name
+        self.task = task
+        self.payload = payload
+        self.priority = priority
+        self.cost = cost
+        self.size = 0
+        self.coalesce_key: str | None = None
+        self.coalesced = 0
+        self.not_before = 0.0
+        self.state = JOB_QUEUED
+        self.error: str | None = None
+        self.spool_ids: list[str] = []
+        self.stages: dict[str, float] = {}
+        self.created_at = created_at or time.time()
+        self.observer: Callable[["Job"], None] | None = None
+        self._marks: dict[str, float] = {JOB_QUEUED: time.monotonic()}
+        self._finished = threading.Event()
+        self._callbacks: list[Callable[["Job"], None]] = []
+        self._callbacks_lock = threading.Lock()
+
+    def _notify(self):
+        if self.observer is not None:
+            try:
+                self.observer(self)
+            except Exception as e:
+                print(f"Failed to persist job {self.id}: {e}")
+
+    def advance(self, state: str, error: str | None = None):
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state '{state}'.")
+        self.state = state
+        self.error = error
+        self._marks[state] = time.monotonic()
+        self._notify()
+        if state in JOB_FINAL_STATES:
+            with self._callbacks_lock:
+                self._finished.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback(self)
+
+    def add_done_callback(self, callback: Callable[["Job"], None]):
+        with self._callbacks_lock:
+            if not self._finished.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_spool_ids(self, spool_ids: list[str]):
+        self.spool_ids = list(spool_ids)
+        self._notify()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._finished.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def timings(self) -> dict:
+        now = time.monotonic()
+        marks = sorted(self._marks.items(), key=lambda mark: mark[1])
+        result = {}
+        for i, (state, start) in enumerate(marks):
+            if state in JOB_FINAL_STATES:
+                continue
+            end = marks[i + 1][1] if i + 1 < len(marks) else now
+            result[state] = round(end - start, 4)
+        result['total'] = round((marks[-1][1] if self.finished else now) - marks[0][1], 4)
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'type': self.kind,
+            'printer': self.printer,
+            'state': self.state,
+            'error': self.error,
+            'spool_ids': list(self.spool_ids),
+            'priority': self.priority,
+            'cost': round(self.cost, 2),
+            'coalesced': self.coalesced,
+            'created_at': round(self.created_at, 3),
+            'timings': self.timings(),
+        }
+
+
+class PrinterQueue:
+    def __init__(self, concurrency: int = 1, aging: float = 1.0):
+        self.concurrency = concurrency
+        self.aging = aging
+        self._pending: list[Job] = []
+        self._keys: dict[str, Job] = {}
+        self._unfinished = 0
+        self._bytes = 0
+        self._drained: deque[tuple[float, int]] = deque(maxlen=DRAIN_WINDOW)
+        self._cond = threading.Condition()
+
+    def _rank(self, job: Job, now: float) -> tuple:
+        # Higher priorities first, then the cheapest job; waiting lowers the cost, so bulk jobs do not starve
+        waited = now - job._marks[JOB_QUEUED]
+        return -job.priority, job.cost - waited * self.aging, job.created_at
+
+    def _retry_after(self, jobs: int, size: int) -> int:
+        # Estimated seconds until enough jobs (and bytes) have drained, based on the recently finished jobs
+        if len(self._drained) < 2 or self._drained[-1][0] <= self._drained[0][0]:
+            return 5
+        span = self._drained[-1][0] - self._drained[0][0]
+        job_rate = (len(self._drained) - 1) / span
+        byte_rate = sum(drained for _, drained in list(self._drained)[1:]) / span
+        seconds = jobs / job_rate
+        if size > 0:
+            seconds = max(seconds, size / byte_rate if byte_rate > 0 else RETRY_AFTER_RANGE[1])
+        return min(max(math.ceil(seconds), RETRY_AFTER_RANGE[0]), RETRY_AFTER_RANGE[1])
+
+    def admit_and_put(self, job: Job, max_queued: int, max_bytes: int, prepare: Callable[[Job], None] | None = None):
+        # Checking the limits and queueing the job happen under one lock hold, so concurrent submissions cannot overshoot them
+        with self._cond:
+            excess_jobs = len(self._pending) + 1 - max_queued if max_queued > 0 else 0
+            excess_bytes = self._bytes + job.size - max_bytes if max_bytes > 0 and job.size > 0 else 0
+            if excess_jobs <= 0 and excess_bytes <= 0:
+                if prepare is not None:
+                    prepare(job)
+                self._put(job)
+                return
+            details = {
+                'printer': job.printer,
+                'queued': len(self._pending),
+                'max_queued': max_queued,
+                'bytes': self._bytes,
+                'max_bytes': max_bytes,
+            }
+            retry_after = self._retry_after(max(excess_jobs, 0), max(excess_bytes, 0))
+        if excess_jobs > 0:
+            metrics.REJECTED.inc(job.printer, "jobs")
+            raise QueueFull(f"Too many queued jobs for printer '{job.printer}', please retry later.", job.printer, retry_after, details)
+        metrics.REJECTED.inc(job.printer, "bytes")
+        raise QueueFull(f"Too many bytes queued for printer '{job.printer}', please retry later.", job.printer, retry_after, details)
+
+    def admit_size(self, printer_name: str, size: int, max_bytes: int):
+        # Uploads announcing more bytes than the printer has left are rejected before their body is read
+        with self._cond:
+            excess_bytes = self._bytes + size - max_bytes if max_bytes > 0 and size > 0 else 0
+            if excess_bytes <= 0:
+                return
+            details = {'printer': printer_name, 'bytes': self._bytes, 'max_bytes': max_bytes, 'content_length': size}
+            retry_after = self._retry_after(0, excess_bytes)
+        metrics.REJECTED.inc(printer_name, "bytes")
+        raise QueueFull(f"Too many bytes queued for printer '{printer_name}', please retry later.", printer_name, retry_after, details)
+
+    def _put(self, job: Job):
+        self._bytes += job.size
+        self._pending.append(job)
+        if job.coalesce_key is not None:
+            self._keys[job.coalesce_key] = job
+        self._unfinished += 1
+        self._cond.notify()
+
+    def merge(self, key: str, quantity: int, cost: float) -> Job | None:
+        with self._cond:
+            job = self._keys.get(key)
+            if job is None or time.monotonic() >= job.not_before:
+                return None
+            job.payload['quantity'] += quantity
+            job.cost += cost
+            job.coalesced += 1
+            return job
+
+    def get(self) -> Job:
+        with self._cond:
+            while True:
+                # Jobs inside their coalescing window are held back until the window closes
+                now = time.monotonic()
+                ready = [pending for pending in self._pending if pending.not_before <= now]
+                if ready:
+                    break
+                timeout = min((pending.not_before for pending in self._pending), default=None)
+                self._cond.wait(timeout - now if timeout is not None else None)
+            job = min(ready, key=lambda pending: self._rank(pending, now))
+            self._pending.remove(job)
+            if job.coalesce_key is not None and self._keys.get(job.coalesce_key) is job:
+                del self._keys[job.coalesce_key]
+            return job
+
+    def task_done(self, job: Job):
+        with self._cond:
+            self._bytes -= job.size
+            self._drained.append((time.monotonic(), job.size))
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._cond.notify_all()
+
+    def join(self):
+        with self._cond:
+            while self._unfinished > 0:
+                self._cond.wait()
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def active(self) -> int:
+        with self._cond:
+            return self._unfinished - len(self._pending)
+
+    def queued_bytes(self) -> int:
+        with self._cond:
+            return self._bytes
+
+
+class JobQueue:
+    def __init__(self, history: int = 1000, store: JobStore | None = None):
+        self.history = history
+        self.store = store
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queues: dict[str, PrinterQueue] = {}
+        self._workers: dict[str, list[threading.Thread]] = {}
+        self._lock = threading.Lock()
+        self._coalesce_lock = threading.Lock()
+        self._recovering = False
+
+    def submit(self, job: Job, window: float = 0.0) -> Job:
+        if job.coalesce_key is None or window <= 0:
+            return self._enqueue(job)
+
+        # Identical jobs within the window of a queued job add their quantity to it instead
+        with self._coalesce_lock:
+            merged = self._coalesce(job)
+            if merged is not None:
+                return merged
+            job.not_before = job._marks[JOB_QUEUED] + window
+            return self._enqueue(job)
+
+    def _enqueue(self, job: Job) -> Job:
+        with self._lock:
+            pending = self._queues.get(job.printer)
+            if pending is None:
+                # Each printer runs at most `concurrency` jobs at once, printers do not block each other
+                pending = self._queues[job.printer] = PrinterQueue(
+                    _printer_concurrency(job.printer),
+                    float(config.get_option("jobs.aging", 1.0) or 0)
+                )
+                self._workers[job.printer] = []
+                for i in range(pending.concurrency):
+                    worker = threading.Thread(
+                        target=self._work,
+                        args=(pending, i),
+                        name=f"pex-jobs-{job.printer}-{i}",
+                        daemon=True
+                    )
+                    self._workers[job.printer].append(worker)
+                    worker.start()
+
+        # Admission control: full queues reject new jobs, so clients back off instead of piling up
+        if self._recovering:
+            limits = (0, 0)
+        else:
+            limits = (
+                int(_printer_option(job.printer, "max_queued", 100) or 0),
+                int(_printer_option(job.printer, "max_queued_bytes", 256 * 1024 * 1024) or 0)
+            )
+        pending.admit_and_put(job, *limits, prepare=self._register)
+        return job
+
+    def _register(self, job: Job):
+        self._persist(job)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+    def admit_upload(self, printer_name: str, size: int):
+        with self._lock:
+            pending = self._queues.get(printer_name)
+        if pending is not None:
+            pending.admit_size(printer_name, size, int(_printer_option(printer_name, "max_queued_bytes", 256 * 1024 * 1024) or 0))
+
+    def _coalesce(self, duplicate: Job) -> Job | None:
+        with self._lock:
+            pending = self._queues.get(duplicate.printer)
+        job = pending.merge(duplicate.coalesce_key, duplicate.payload['quantity'], duplicate.cost) if pending is not None else None
+        if job is None:
+            return None
+        metrics.COALESCED.inc(job.printer)
+        if self.store is not None:
+            self.store.save(job, job.payload)
+        return job
+
+    def join(self):
+        with self._lock:
+            pending = list(self._queues.values())
+        for queue_ in pending:
+            queue_.join()
+
+    def _persist(self, job: Job):
+        if self.store is None:
+            return
+        self.store.save(job, job.payload or {})
+        job.observer = self.store.save
+
+    def _settle(self, kind: str, printer_name: str, job_id: str, created_at: float, state: str, error: str | None = None, spool_ids: list[str] | None = None) -> Job:
+        job = Job(kind, printer_name, None, job_id=job_id, created_at=created_at)
+        job.spool_ids = list(spool_ids or [])
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._persist(job)
+        job.advance(state, error)
+        return job
+
+    def recover(self, owners: list[int] | None = None, before: float | None = None) -> tuple[int, int]:
+        if self.store is None:
+            return 0, 0
+
+        requeued = failed = 0
+        self._recovering = True
+        try:
+            for record, payload in self.store.unfinished(JOB_FINAL_STATES, owners, before):
+                state = self._recover(record, payload)
+                requeued += state == JOB_QUEUED
+                failed += state == JOB_FAILED
+        finally:
+            self._recovering = False
+        return requeued, failed
+
+    def _recover(self, record: dict, payload: dict | None) -> str:
+        args = (record['type'], record['printer'], record['id'], record['created_at'])
+
+        # Jobs which reached the spooler are not submitted again, that could print them twice
+        if record['state'] == JOB_SPOOLING:
+            if record['spool_ids']:
+                return self._settle(*args, JOB_DONE, spool_ids=record['spool_ids']).state
+            return self._settle(*args, JOB_FAILED, "The job was interrupted while spooling and may have been printed.").state
+
+        try:
+            _restore(payload or {}, record['type'], record['id'], record['created_at'])
+            return JOB_QUEUED
+        except Exception as e:
+            return self._settle(*args, JOB_FAILED, f"The job could not be restored after a restart: {e}").state
+
+    def stats(self) -> dict:
+        # Printer queues are read outside the lock, submissions take it while holding a printer queue
+        with self._lock:
+            jobs = len(self._jobs)
+            queues = dict(self._queues)
+        result = {
+            'jobs': jobs,
+            'queued': {printer_name: pending.qsize() for printer_name, pending in queues.items()},
+            'active': {printer_name: pending.active() for printer_name, pending in queues.items()},
+            'bytes': {printer_name: pending.queued_bytes() for printer_name, pending in queues.items()},
+        }
+        result['store'] = self.store.stats() if self.store is not None else None
+        return result
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, job_id: str) -> dict | None:
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.store.get(job_id) if self.store is not None else None
+
+    def list_jobs(
+        self,
+        printer_name: str | None = None,
+        state: str | None = None,
+        since: float | None = None,
+        after: tuple[float, str] | None = None,
+        limit: int = 100
+    ) -> tuple[list[dict], tuple[float, str] | None]:
+        if self.store is not None:
+            return self.store.query(printer_name, state, since, after, limit)
+
+        with self._lock:
+            found = sorted(self._jobs.values(), key=lambda job: (job.created_at, job.id))
+        found = [
+            job for job in found
+            if (printer_name is None or job.printer == printer_name)
+            and (state is None or job.state == state)
+            and (since is None or job.created_at >= since)
+            and (after is None or (job.created_at, job.id) > after)
+        ]
+        cursor = (found[limit - 1].created_at, found[limit - 1].id) if len(found) > limit else None
+        return [job.to_dict() for job in found[:limit]], cursor
+
+    def _prune(self):
+        overflow = len(self._jobs) - self.history
+        if overflow <= 0:
+            return
+        for job_id in [jid for jid, job in self._jobs.items() if job.finished][:overflow]:
+            del self._jobs[job_id]
+
+    def _work(self, pending: PrinterQueue, slot: int):
+        while True:
+            job: Job = pending.get()
+            queued = job.timings().get(JOB_QUEUED, 0.0)
+            job.stages["queue"] = queued
+            metrics.STAGE_SECONDS.observe(queued, "queue", job.printer)
+            metrics.trace_begin(job.stages)
+            submission = None
+            try:
+                with _printer_slot(job.printer, slot):
+                    submission = job.task(job)
+            except Exception as e:
+                job.advance(JOB_FAILED, str(e))
+                metrics.JOBS.inc(job.printer, job.kind, job.state)
+            finally:
+                metrics.trace_end()
+                # The slot is free as soon as the job has been spooled, the next job does not wait for the printer
+                pending.task_done(job)
+            if not job.finished:
+                self._complete(job, submission)
+
+    @staticmethod
+    def _complete(job: Job, submission: "printer.Submission | None"):
+        def finish(_=None):
+            if completion is not None:
+                elapsed = time.perf_counter() - started
+                job.stages["wait"] = job.stages.get("wait", 0.0) + elapsed
+                metrics.STAGE_SECONDS.observe(elapsed, "wait", job.printer)
+            job.advance(JOB_DONE)
+            metrics.JOBS.inc(job.printer, job.kind, job.state)
+
+        # Jobs are done once the spooler has finished them, the tracker resolves the completion in the background
+        completion = submission.completion if submission is not None else None
+        started = time.perf_counter()
+        if completion is None:
+            finish()
+        else:
+            completion.add_done_callback(finish)
+
+
+_queue: JobQueue | None = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            store = None
+            if config.get_option("jobs.persistent", True) is not False:
+                retention = float(config.get_option("jobs.retention_days", 7) or 0) * 86400
+                store = JobStore(STORE_FILE, retention)
+                store.compact()
+            _queue = JobQueue(int(config.get_option("jobs.history", 1000) or 1000), store)
+        return _queue
+
+
+def get_job(job_id: str) -> Job | None:
+    return get_queue().get(job_id)
+
+
+def admit_upload(printer_name: str, size: int):
+    get_queue().admit_upload(printer.resolve_printer_name(printer_name), size)
+
+
+def _printer_option(printer_name: str, option: str, default):
+    # Per-printer values are keyed by printer name or alias, e.g. `jobs.printer_concurrency.labels`
+    values = config.get_option(f"jobs.printer_{option}", {}) or {}
+    for alias, value in values.items():
+        if printer.resolve_printer_name(alias) == printer_name:
+            return value
+    return config.get_option(f"jobs.{option}", default)
+
+
+@contextmanager
+def _printer_slot(printer_name: str, slot: int):
+    # Worker processes (server.workers) share the concurrency slots of a printer through file locks
+    if sys.platform == "win32" or int(config.get_option("server.workers", 1) or 1) <= 1:
+        yield
+        return
+    os.makedirs(LOCK_PATH, exist_ok=True)
+    name = hashlib.sha1(printer_name.encode("utf-8")).hexdigest()[:16]
+    with open(LOCK_PATH / f"{name}.{slot}.lock", "a+b") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _printer_concurrency(printer_name: str) -> int:
+    return max(1, int(_printer_option(printer_name, "concurrency", 1) or 1))
+
+
+def parse_priority(value) -> int:
+    if value is None or value == "":
+        return 0
+    try:
+        priority = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"The priority must be an integer between {PRIORITY_RANGE[0]} and {PRIORITY_RANGE[1]}.")
+    return min(max(priority, PRIORITY_RANGE[0]), PRIORITY_RANGE[1])
+
+
+def _document_cost(document: Document, quantity: int) -> float:
+    pages = document.page_count()
+    if pages is None:
+        pages = max(1.0, document.size / BYTES_PER_PAGE)
+    return pages * quantity
+
+
+def _label_cost(pages: list[list[dict]], quantity: int) -> float:
+    return sum(len(lines) for lines in pages) / LINES_PER_PAGE * quantity
+
+
+def _stored_document(digest: str | None, name: str | None) -> Document:
+    store = documents.get_store()
+    document = store.get(digest, name) if store is not None and digest else None
+    if document is None:
+        raise ValueError("The document is no longer available.")
+    return document
+
+
+def _restore_entry(entry: list | dict) -> Tuple[Document | dict, int]:
+    if isinstance(entry, dict):
+        entry = dict(entry)
+        return entry, entry.pop('quantity')
+    digest, name, quantity = entry
+    return _stored_document(digest, name), quantity
+
+
+def _restore(payload: dict, kind: str, job_id: str, created_at: float) -> Job:
+    payload = dict(payload)
+    submit = payload.pop('submit', None)
+    if submit == "file":
+        document = _stored_document(payload.pop('sha256'), payload.pop('name'))
+        return submit_file(document, **payload, job_id=job_id, created_at=created_at)
+    elif submit == "documents":
+        entries = [_restore_entry(entry) for entry in payload.pop('documents')]
+        return submit_documents(entries, **payload, kind=kind, job_id=job_id, created_at=created_at)
+    elif submit == "pages":
+        return submit_pages(**payload, kind=kind, job_id=job_id, created_at=created_at)
+    raise ValueError("The job does not contain a restorable payload.")
+
+
+def submit_file(
+    document: Document,
+    printer_name: str,
+    paper_format: Union[str, Tuple[int, int]],
+    orientation: str = 'portrait',
+    quantity: int = 1,
+    priority: int = 0,
+    job_id: str | None = None,
+    created_at: float | None = None
+) -> Job:
+    queue_ = get_queue()
+    try:
+        target, fmt, orientation, quantity = printer.prepare_job(printer_name, paper_format, orientation, quantity)
+        cost = _document_cost(document, quantity)
+        # Persistent jobs keep their upload in the document store, so they can be restored after a restart
+        if queue_.store is not None:
+            _keep_documents([document], hold=True)
+    except Exception:
+        document.close()
+        raise
+    payload = {
+        'submit': "file",
+        'sha256': document.digest,
+        'name': document.name,
+        'printer_name': printer_name,
+        'paper_format': paper_format,
+        'orientation': orientation,
+        'quantity': quantity,
+        'priority': priority,
+    }
+
+    def task(job: Job):
+        job.advance(JOB_SPOOLING)
+        _keep_documents([document])
+        with metrics.stage("spool", target):
+            submission = printer.spool_document(document, target, paper_format, fmt, orientation, quantity)
+        job.set_spool_ids(submission.job_ids)
+        return submission
+
+    job = Job("file", target, task, payload, job_id, created_at, priority, cost)
+    job.size = document.size
+    # Closing the document releases its pin in the document store once the job has finished
+    job.add_done_callback(lambda _: document.close())
+    try:
+        return queue_.submit(job)
+    except QueueFull:
+        document.close()
+        raise
+
+
+def _keep_documents(entries: list[Document], hold: bool = False):
+    store = documents.get_store()
+    if store is None:
+        return
+    for document in entries:
+        if document.in_memory:
+            store.put(document)
+            if hold:
+                store.hold(document)
+
+
+def _render_labels(entry: dict, fmt: Tuple[int, int], orientation: str) -> Document:
+    data = labels.render_pages(entry['pages'], fmt, orientation, entry['font_name'], entry['font_size'], entry['line_height'])
+    return Document.from_bytes(labels.label_name(), data)
+
+
+def submit_documents(
+    entries: list[Tuple[Document | dict, int]],
+    printer_name: str,
+    paper_format: Union[str, Tuple[int, int]],
+    orientation: str = 'portrait',
+    kind: str = "batch",
+    priority: int = 0,
+    job_id: str | None = None,
+    created_at: float | None = None
+) -> Job:
+    # Label entries ({'pages', 'font_name', 'font_size', 'line_height'}) are rendered by the job,
+    # so they are spooled together with the documents
+    files = [document for document, _ in entries if isinstance(document, Document)]
+    queue_ = get_queue()
+    try:
+        target, fmt, orientation, _ = printer.prepare_job(printer_name, paper_format, orientation, 1)
+        cost = sum(
+            _document_cost(entry, quantity) if isinstance(entry, Document) else _label_cost(entry['pages'], quantity)
+            for entry, quantity in entries
+        )
+        if queue_.store is not None:
+            _keep_documents(files, hold=True)
+    except Exception:
+        for document in files:
+            document.close()
+        raise
+    payload = {
+        'submit': "documents",
+        'documents': [
+            [entry.digest, entry.name, quantity] if isinstance(entry, Document) else {**entry, 'quantity': quantity}
+            for entry, quantity in entries
+        ],
+        'printer_name': printer_name,
+        'paper_format': paper_format,
+        'orientation': orientation,
+        'priority': priority,
+    }
+
+    def task(job: Job):
+        spooled = entries
+        if len(files) < len(entries):
+            job.advance(JOB_RENDERING)
+            with metrics.stage("render", target):
+                spooled = [
+                    (entry if isinstance(entry, Document) else _render_labels(entry, fmt, orientation), quantity)
+                    for entry, quantity in entries
+                ]
+        job.advance(JOB_SPOOLING)
+        _keep_documents(files)
+        with metrics.stage("spool", target):
+            submission = printer.spool_documents(spooled, target, paper_format, fmt, orientation)
+        job.set_spool_ids(submission.job_ids)
+        return submission
+
+    job = Job(kind, target, task, payload, job_id, created_at, priority, cost)
+    job.size = sum(document.size for document in files)
+    job.add_done_callback(lambda _: [document.close() for document in files])
+    try:
+        return queue_.submit(job)
+    except QueueFull:
+        for document in files:
+            document.close()
+        raise
+
+
+def submit_lines(
+    lines: list[dict],
+    printer_name: str,
+    paper_format: Union[str, Tuple[int, int]],
+    orientation: str = 'portrait',
+    quantity: int = 1,
+    font_name: str = None,
+    font_size: int = 10,
+    line_height: int = 12,
+    priority: int = 0,
+) -> Job:
+    return submit_pages([lines], printer_name, paper_format, orientation, quantity, font_name, font_size, line_height, priority=priority)
+
+
+def submit_pages(
+    pages: list[list[dict]],
+    printer_name: str,
+    paper_format: Union[str, Tuple[int, int]],
+    orientation: str = 'portrait',
+    quantity: int = 1,
+    font_name: str = None,
+    font_size: int = 10,
+    line_height: int = 12,
+    kind: str = "lines",
+    priority: int = 0,
+    job_id: str | None = None,
+    created_at: float | None = None
+) -> Job:
+    target, fmt, orientation, quantity = printer.prepare_job(printer_name, paper_format, orientation, quantity)
+    payload = {
+        'submit': "pages",
+        'pages': pages,
+        'printer_name': printer_name,
+        'paper_format': paper_format,
+        'orientation': orientation,
+        'quantity': quantity,
+        'font_name': font_name,
+        'font_size': font_size,
+        'line_height': line_height,
+        'priority': priority,
+    }
+
+    def task(job: Job):
+        job.advance(JOB_RENDERING)
+        with metrics.stage("render", target):
+            data = labels.render_pages(pages, fmt, orientation, font_name, font_size, line_height)
+        job.advance(JOB_SPOOLING)
+        # Coalesced submissions have added their quantity to the payload while the job was queued
+        with metrics.stage("spool", target):
+            submission = printer.spool_document(Document.from_bytes(labels.label_name(), data), target, paper_format, fmt, orientation, job.payload['quantity'])
+        job.set_spool_ids(submission.job_ids)
+        return submission
+
+    job = Job(kind, target, task, payload, job_id, created_at, priority, _label_cost(pages, quantity))
+    window = float(_printer_option(target, "coalesce_ms", 0) or 0) / 1000
+    if window > 0 and job_id is None:
+        job.coalesce_key = canonical_hash(kind, pages, list(fmt), orientation, font_name, font_size, line_height, priority)
+    return get_queue().submit(job, window)
@@ -0,0 +1,189 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    printer TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    spool_ids TEXT NOT NULL DEFAULT '[]',
+    payload TEXT,
+    timings TEXT NOT NULL DEFAULT '{}',
+    priority INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 1.0,
+    coalesced INTEGER NOT NULL DEFAULT 0,
+    owner INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_printer ON jobs (printer, created_at);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at, id);
+"""
+
+MIGRATIONS = (
+    ("priority", "INTEGER NOT NULL DEFAULT 0"),
+    ("cost", "REAL NOT NULL DEFAULT 1.0"),
+    ("coalesced", "INTEGER NOT NULL DEFAULT 0"),
+    ("owner", "INTEGER"),
+)
+
+
+class JobStore:
+    def __init__(self, path: str | Path, retention: float = 7 * 86400, compact_every: int = 500):
+        self.path = Path(path)
+        self.retention = retention
+        self.compact_every = compact_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.path.parent, exist_ok=True)
+
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("PRAGMA busy_timeout = 5000")
+        self._conn.executescript(SCHEMA)
+        # Stores of older versions lack the scheduling columns and the owner (the process ID of the server worker
+        # which queued the job)
+        columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        for name, definition in MIGRATIONS:
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        # Same shape as Job.to_dict(), so /pex/jobs looks the same whichever worker answers
+        return {
+            'id': row['id'],
+            'type': row['type'],
+            'printer': row['printer'],
+            'state': row['state'],
+            'error': row['error'],
+            'spool_ids': json.loads(row['spool_ids']),
+            'priority': row['priority'],
+            'cost': round(row['cost'], 2),
+            'coalesced': row['coalesced'],
+            'created_at': round(row['created_at'], 3),
+            'timings': json.loads(row['timings']),
+        }
+
+    def save(self, job, payload: dict | None = None):
+        now = time.time()
+        with self._lock:
+            if payload is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs (id, type, printer, state, error, spool_ids, payload, timings,"
+                    " priority, cost, coalesced, owner, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.kind, job.printer, job.state, job.error, json.dumps(job.spool_ids),
+                     json.dumps(payload), json.dumps(job.timings()), job.priority, job.cost, job.coalesced,
+                     os.getpid(), job.created_at, now)
+                )
+                self._writes += 1
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, error = ?, spool_ids = ?, timings = ?, updated_at = ? WHERE id = ?",
+                    (job.state, job.error, json.dumps(job.spool_ids), json.dumps(job.timings()), now, job.id)
+                )
+            compact = self.compact_every > 0 and self._writes >= self.compact_every
+        if compact:
+            self.compact()
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row is not None else None
+
+    def query(
+        self,
+        printer: str | None = None,
+        state: str | None = None,
+        since: float | None = None,
+        after: tuple[float, str] | None = None,
+        limit: int = 100
+    ) -> tuple[list[dict], tuple[float, str] | None]:
+        where, args = [], []
+        if printer is not None:
+            where.append("printer = ?")
+            args.append(printer)
+        if state is not None:
+            where.append("state = ?")
+            args.append(state)
+        if since is not None:
+            where.append("created_at >= ?")
+            args.append(since)
+        if after is not None:
+            where.append("(created_at > ? OR (created_at = ? AND id > ?))")
+            args.extend([after[0], after[0], after[1]])
+
+        sql = "SELECT * FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at, id LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, args + [limit + 1]).fetchall()
+
+        # The cursor of the next page is the sort key of the last returned row
+        more = len(rows) > limit
+        rows = rows[:limit]
+        cursor = (rows[-1]['created_at'], rows[-1]['id']) if more else None
+        return [self._row(row) for row in rows], cursor
+
+    def unfinished(
+        self,
+        final_states: tuple[str, ...],
+        owners: list[int] | None = None,
+        before: float | None = None
+    ) -> list[tuple[dict, dict | None]]:
+        where = [f"state NOT IN ({', '.join('?' for _ in final_states)})"]
+        args = list(final_states)
+        if owners is not None:
+            if not owners:
+                return []
+            where.append(f"owner IN ({', '.join('?' for _ in owners)})")
+            args.extend(owners)
+        if before is not None:
+            where.append("created_at < ?")
+            args.append(before)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE {' AND '.join(where)} ORDER BY created_at, id",
+                args
+            ).fetchall()
+        return [(self._row(row), json.loads(row['payload']) if row['payload'] else None) for row in rows]
+
+    def compact(self) -> int:
+        with self._lock:
+            self._writes = 0
+            if self.retention <= 0:
+                return 0
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE created_at < ? AND state IN ('done', 'failed')",
+                (time.time() - self.retention,)
+            )
+            if cursor.rowcount:
+                self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        try:
+            size = os.path.getsize(self.path) + os.path.getsize(f"{self.path}-wal")
+        except OSError:
+            size = os.path.getsize(self.path) if self.path.exists() else 0
+        return {
+            'path': str(self.path),
+            'jobs': count,
+            'size': size,
+            'retention': self.retention,
+        }
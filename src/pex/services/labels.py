@@ -0,0 +1,360 @@
+import multiprocessing
+import string
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+from fpdf import FPDF
+from typing import Iterator, Tuple, Union
+from . import fonts
+from .cache import LRUCache, canonical_hash
+from .. import config
+
+PT_TO_MM = 0.352777778
+
+_render_cache: LRUCache | None = None
+_render_cache_lock = threading.Lock()
+_render_pool: ProcessPoolExecutor | None = None
+_render_pool_size = 0
+_render_pool_users: dict[ProcessPoolExecutor, int] = {}
+_render_pool_lock = threading.Lock()
+_templates: dict[str, "LabelTemplate"] = {}
+_templates_snapshot = None
+_templates_lock = threading.Lock()
+
+
+def label_name() -> str:
+    return f"custom_label-{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.pdf"
+
+
+def normalize_line(entry: Union[str, dict], font_name: str | None = None, font_size: int = 10, line_height: int = 12) -> dict:
+    if isinstance(entry, str):
+        return {
+            'text': entry,
+            'font': font_name,
+            'size': font_size,
+            'height': line_height,
+            'bold': False,
+            'italic': False,
+            'underline': False,
+            'strikethrough': False,
+        }
+    elif isinstance(entry, dict):
+        return {
+            'text': entry.get('text', ''),
+            'font': entry.get('font', font_name),
+            'size': entry.get('size', font_size),
+            'height': entry.get('height', line_height),
+            'bold': entry.get('bold', False),
+            'italic': entry.get('italic', False),
+            'underline': entry.get('underline', False),
+            'strikethrough': entry.get('strikethrough', False),
+        }
+    raise ValueError("The lines structure is invalid or corrupt.")
+
+
+def _line_style(line: dict) -> str:
+    style = ""
+    if line.get("bold", False):
+        style += "B"
+    if line.get("italic", False):
+        style += "I"
+    if line.get("strikethrough", False):
+        style += "S"
+    if line.get("underline", False):
+        style += "U"
+    return style
+
+
+def _wrap_text(line: dict, pdf, max_width: float, font_name: str = 'helvetica', font_size: int = 10) -> list[dict]:
+    text = str(line.get("text", "") or "")
+    words: list[str] = text.split()
+    if not words:
+        # Empty lines are kept as vertical space
+        return [{**line, "text": "", "width": 0.0}]
+
+    # Measure with the font of the line itself, word widths are summed up from the cached metrics
+    metrics = fonts.set_font(pdf, line.get("font") or font_name, _line_style(line), line.get("size") or font_size)
+    space = metrics.width(pdf, " ")
+    result: list[dict] = []
+    current: list[str] = []
+    current_width = 0.0
+
+    def flush():
+        if current:
+            new_line = dict(line)
+            new_line["text"] = " ".join(current)
+            new_line["width"] = current_width
+            result.append(new_line)
+
+    for word in words:
+        width = metrics.width(pdf, word)
+        if current and current_width + space + width <= max_width:
+            current.append(word)
+            current_width += space + width
+            continue
+
+        flush()
+        current, current_width = [word], width
+        if width <= max_width:
+            continue
+
+        # Words wider than the label are broken at the last character that still fits
+        chunk, chunk_width = "", 0.0
+        for char in word:
+            char_width = metrics.width(pdf, char)
+            if chunk and chunk_width + char_width > max_width:
+                current, current_width = [chunk], chunk_width
+                flush()
+                chunk, chunk_width = "", 0.0
+            chunk += char
+            chunk_width += char_width
+        current, current_width = [chunk], chunk_width
+
+    flush()
+    return result
+
+
+def get_render_cache() -> LRUCache | None:
+    global _render_cache
+    max_size = int(config.get_option("render.cache_size", 16 * 1024 * 1024) or 0)
+    if max_size <= 0:
+        return None
+    with _render_cache_lock:
+        if _render_cache is None:
+            _render_cache = LRUCache(max_size)
+        _render_cache.max_size = max_size
+        return _render_cache
+
+
+def _init_render_worker():
+    fonts.get_registry().load()
+
+
+def _warm_render_worker() -> bool:
+    return True
+
+
+def _get_render_pool() -> ProcessPoolExecutor | None:
+    global _render_pool, _render_pool_size
+    processes = int(config.get_option("render.processes", 0) or 0)
+    if processes <= 0 or processes != _render_pool_size:
+        if _render_pool is not None and _render_pool not in _render_pool_users:
+            _render_pool.shutdown(wait=False)
+        _render_pool, _render_pool_size = None, 0
+    if processes > 0 and _render_pool is None:
+        # Workers are started from a clean process (not forked from the threaded server) and preload the fonts
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _render_pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_render_worker
+        )
+        _render_pool_size = processes
+    return _render_pool
+
+
+def get_render_pool() -> ProcessPoolExecutor | None:
+    with _render_pool_lock:
+        return _get_render_pool()
+
+
+@contextmanager
+def _lease_render_pool() -> Iterator[ProcessPoolExecutor | None]:
+    # A pool replaced after a config change is shut down by its last user, so renders already holding it still finish
+    with _render_pool_lock:
+        pool = _get_render_pool()
+        if pool is not None:
+            _render_pool_users[pool] = _render_pool_users.get(pool, 0) + 1
+    try:
+        yield pool
+    finally:
+        if pool is not None:
+            with _render_pool_lock:
+                _render_pool_users[pool] -= 1
+                if _render_pool_users[pool] <= 0:
+                    del _render_pool_users[pool]
+                    if pool is not _render_pool:
+                        pool.shutdown(wait=False)
+
+
+def warm_render_pool():
+    with _lease_render_pool() as pool:
+        if pool is not None:
+            for future in [pool.submit(_warm_render_worker) for _ in range(_render_pool_size)]:
+                future.result()
+
+
+def _render_offloaded(*args) -> bytes:
+    with _lease_render_pool() as pool:
+        if pool is None:
+            return _render_pages(*args)
+        try:
+            return pool.submit(_render_pages, *args).result()
+        except BrokenProcessPool:
+            # A crashed render worker breaks the pool, the next render starts a new one
+            global _render_pool, _render_pool_size
+            with _render_pool_lock:
+                if _render_pool is pool:
+                    _render_pool, _render_pool_size = None, 0
+    return _render_pages(*args)
+
+
+def render_lines(
+    lines: list[dict],
+    fmt: Tuple[int, int],
+    orientation: str = 'portrait',
+    font_name: str = None,
+    font_size: int = 10,
+    line_height: int = 12,
+) -> bytes:
+    return render_pages([lines], fmt, orientation, font_name, font_size, line_height)
+
+
+def render_pages(
+    pages: list[list[dict]],
+    fmt: Tuple[int, int],
+    orientation: str = 'portrait',
+    font_name: str = None,
+    font_size: int = 10,
+    line_height: int = 12,
+) -> bytes:
+    cache = get_render_cache()
+    if cache is None:
+        return _render_offloaded(pages, fmt, orientation, font_name, font_size, line_height)
+
+    registry = fonts.get_registry()
+    registry.load()
+    key = canonical_hash(pages, list(fmt), orientation, font_name, font_size, line_height, registry.version)
+    data = cache.get(key)
+    if data is None:
+        data = _render_offloaded(pages, fmt, orientation, font_name, font_size, line_height)
+        cache.put(key, data)
+    return data
+
+
+def _render_pages(
+    pages: list[list[dict]],
+    fmt: Tuple[int, int],
+    orientation: str = 'portrait',
+    font_name: str = None,
+    font_size: int = 10,
+    line_height: int = 12,
+) -> bytes:
+    # Page dimensions
+    width_mm, height_mm = fmt
+    font_name = font_name if isinstance(font_name, str) else 'helvetica'
+
+    # Create FPDF-Document
+    pdf = FPDF(
+        orientation='P' if orientation == 'portrait' else 'L',
+        unit='mm',
+        format=(width_mm, height_mm),
+    )
+    pdf.set_auto_page_break(False)
+    pdf.set_text_color(0, 0, 0)
+
+    for lines in pages:
+        pdf.add_page()
+        fonts.set_font(pdf, font_name, "", font_size)
+
+        # Wrap Text
+        margin_mm = 2.0
+        max_text_width_mm = width_mm - 2 * margin_mm
+        wrapped_lines: list[dict] = []
+        for line in lines:
+            wrapped_lines.extend(_wrap_text(line, pdf, max_text_width_mm, font_name, font_size))
+
+        # Vertical alignment
+        total_text_height_mm = 0.0
+        for line in wrapped_lines:
+            h = line.get("height", line_height)
+            if not isinstance(h, (int, float)):
+                h = line_height
+            total_text_height_mm += h * PT_TO_MM
+
+        y = (height_mm - total_text_height_mm) / 2 + font_size * PT_TO_MM
+
+        # Write lines
+        for line in wrapped_lines:
+            text = line["text"]
+            height = line.get("height", line_height)
+            if not isinstance(height, (int, float)):
+                height = line_height
+            line_step_mm = height * PT_TO_MM
+            x = (width_mm - line["width"]) / 2
+
+            fonts.set_font(pdf, line.get("font") or font_name, _line_style(line), line.get("size") or font_size)
+            pdf.text(x=x, y=y, txt=text)
+
+            y += line_step_mm
+
+    return bytes(pdf.output())
+
+
+class LabelTemplate:
+    def __init__(self, name: str, spec: dict):
+        if not isinstance(spec, dict) or not isinstance(spec.get('lines'), list) or not spec['lines']:
+            raise ValueError(f"The label template '{name}' requires a non-empty 'lines' list.")
+
+        self.name = name
+        self.paper_format = spec.get('format', 'label')
+        if isinstance(self.paper_format, list):
+            self.paper_format = tuple(self.paper_format)
+        self.orientation = spec.get('orientation', 'portrait')
+        self.font_name = spec.get('font_name', None)
+        self.font_size = int(spec.get('font_size', 10))
+        self.line_height = int(spec.get('line_height', 12))
+        self.lines = [normalize_line(
+            dict(line) if isinstance(line, dict) else line,
+            self.font_name,
+            self.font_size,
+            self.line_height
+        ) for line in spec['lines']]
+
+        # Pre-parse the placeholders of each line, so filling a record only joins strings
+        formatter = string.Formatter()
+        self._parts: list[list[tuple[str, str | None]]] = []
+        self.fields: set[str] = set()
+        for line in self.lines:
+            parts = []
+            for literal, field, format_spec, _ in formatter.parse(str(line['text'] or '')):
+                if field is not None:
+                    if not field or format_spec:
+                        raise ValueError(f"Unsupported placeholder in label template '{name}'.")
+                    self.fields.add(field)
+                parts.append((literal, field))
+            self._parts.append(parts)
+
+    def fill(self, record: dict) -> list[dict]:
+        if not isinstance(record, dict):
+            raise ValueError(f"The records for label template '{self.name}' must be objects.")
+        missing = self.fields.difference(record)
+        if missing:
+            raise ValueError(f"Missing field(s) {', '.join(sorted(missing))} for label template '{self.name}'.")
+
+        result = []
+        for line, parts in zip(self.lines, self._parts):
+            filled = dict(line)
+            filled['text'] = "".join(
+                literal + ("" if field is None else str(record[field])) for literal, field in parts
+            )
+            result.append(filled)
+        return result
+
+
+def get_template(name: str) -> LabelTemplate:
+    global _templates, _templates_snapshot
+    snapshot = config.get_snapshot()
+    with _templates_lock:
+        if _templates_snapshot is not snapshot:
+            _templates = {}
+            _templates_snapshot = snapshot
+        template = _templates.get(name)
+        if template is None:
+            spec = snapshot.get(f"templates.{name}", None) if "." not in name else None
+            if spec is None:
+                raise KeyError(f"The label template '{name}' does not exist.")
+            template = _templates[name] = LabelTemplate(name, spec)
+        return template
@@ -0,0 +1,201 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable
+from .. import config
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(values)
+            if entry is None:
+                entry = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *values)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(round(total, 6))}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {count}"
+
+
+class Callback:
+    def __init__(self, name: str, help: str, kind: str, collect: Callable[[], dict | float | None], labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = labels
+        self._collect = collect
+
+    def samples(self) -> Iterable[str]:
+        # Values are collected on scrape, so there is no bookkeeping on the request path
+        try:
+            values = self._collect()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            if value is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_labels(self.labels, key)} {_number(float(value))}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram | Callback] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name: str, help: str, collect: Callable[[], dict | float | None], labels: tuple[str, ...] = ()) -> Callback:
+    return REGISTRY.register(Callback(name, help, "gauge", collect, labels))
+
+
+def counter_callback(name: str, help: str, collect: Callable[[], dict | float | None], labels: tuple[str, ...] = ()) -> Callback:
+    return REGISTRY.register(Callback(name, help, "counter", collect, labels))
+
+
+STAGE_SECONDS = histogram(
+    "pex_stage_duration_seconds",
+    "Duration of the print pipeline stages.",
+    ("stage", "printer")
+)
+JOBS = counter("pex_jobs_total", "Finished print jobs.", ("printer", "type", "state"))
+REJECTED = counter("pex_jobs_rejected_total", "Print jobs rejected by admission control.", ("printer", "reason"))
+COALESCED = counter("pex_jobs_coalesced_total", "Print requests merged into a queued identical job.", ("printer",))
+
+
+_trace = threading.local()
+
+
+def trace_begin(trace: dict | None = None) -> dict:
+    _trace.current = {} if trace is None else trace
+    return _trace.current
+
+
+def trace_end() -> dict | None:
+    trace = getattr(_trace, 'current', None)
+    _trace.current = None
+    return trace
+
+
+def observe_stage(name: str, elapsed: float, printer: str = ""):
+    # Stage durations also add up in the trace of the current thread (the request or the job)
+    STAGE_SECONDS.observe(elapsed, name, printer)
+    trace = getattr(_trace, 'current', None)
+    if trace is not None:
+        trace[name] = trace.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def stage(name: str, printer: str = ""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start, printer)
+
+
+config.add_reload_hook(lambda elapsed: observe_stage("config", elapsed))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -1,13 +1,14 @@
 import os
-import re
 import subprocess
 import sys
-import tempfile
+import threading
 import time
-from datetime import datetime
-from fpdf import FPDF
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Union, Tuple
+from typing import Callable, Union, Tuple
+from . import cups, labels, metrics, spool, tracker
+from .documents import Document
+from .inventory import PrinterInventory
 from .. import config
 
 if sys.platform == "win32":
@@ -16,7 +17,9 @@ if sys.platform == "win32":
 JOB_STATUS_SPOOLING = 0x0008
 PRINTER_ORIENT_PORTRAIT = 1
 PRINTER_ORIENT_LANDSCAPE = 2
-PT_TO_MM = 0.352777778
+
+_inventory: PrinterInventory | None = None
+_inventory_lock = threading.Lock()
 
 
 def _get_sumatra_path() -> str:
@@ -55,86 +58,69 @@ def _printer_supports_copies(printer_name: str) -> bool:
     if sys.platform == "win32":
         raise NotImplementedError("This function is not supported on Windows systems.")
     try:
-        out = subprocess.check_output(
-            ["lpoptions", "-p", printer_name, "-l"],
-            stderr=subprocess.STDOUT,
-            text=True,
-            timeout=3
-        )
-        return "copies" in out.lower()
+        return cups.get_backend().supports_copies(printer_name)
     except Exception:
         return False
 
 
-def _safe_remove(path: str, attempts: int = 5) -> bool:
-    for i in range(attempts):
-        try:
-            os.remove(path)
+class Submission:
+    def __init__(self, job_ids: list[str] | None = None, completion: Future | None = None):
+        self.job_ids = job_ids or []
+        self.completion = completion
+
+    def wait(self, timeout: float | None = None) -> bool:
+        if self.completion is None:
             return True
-        except Exception:
-            time.sleep(0.2 * (i + 1))
-    return False
+        return self.completion.result(timeout)
+
+
+def _cups_copies_strategy(quantity: int) -> Tuple[int, dict | None, int]:
+    mode = config.get_option('linux_command', '-n')
+    if quantity == 1 or mode == "-n":
+        return quantity, None, 1
+    elif mode == "-o":
+        return 1, {"copies": quantity, "Collate": "true"}, 1
+    return 1, None, quantity
 
 
-def _cups_submit_job(filepath: str, printer: str, copies: int, extra_args: list[str] | None = None) -> str | None:
+def _cups_submit_job(document: Document, printer: str, quantity: int) -> list[str]:
     if sys.platform == "win32":
         raise NotImplementedError("This function is not supported on Windows systems.")
 
-    cmd = ["lp", "-d", printer]
-    if copies > 1:
-        cmd += ["-n", str(copies)]
-    if extra_args:
-        cmd += extra_args
-    cmd.append(filepath)
+    # The "for" mode repeats the document within a single job instead of submitting it once per copy
+    copies, options, repeat = _cups_copies_strategy(quantity)
+    job_id = cups.get_backend().submit([document] * repeat, printer, copies, options)
+    return [job_id] if isinstance(job_id, str) else []
 
-    res = subprocess.run(cmd, capture_output=True, text=True)
-    if res.returncode != 0:
-        raise RuntimeError(res.stderr.strip() or res.stdout.strip() or "The lp command failed.")
-    m = re.search(r"request id is (\S+-\d+)", res.stdout or "")
-    return m.group(1) if m else None
 
-
-def _cups_wait_for_job_disappear(printer: str, job_id: str, timeout: float = 5.0, interval: float = 0.2) -> None:
+def _cups_submit_batch(documents: list[Tuple[Document, int]], printer: str) -> list[str]:
     if sys.platform == "win32":
         raise NotImplementedError("This function is not supported on Windows systems.")
 
-    if not job_id:
-        return
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        st = subprocess.run(["lpstat", "-W", "not-completed", "-o", printer], capture_output=True, text=True)
-        out = (st.stdout or "")
-        if job_id not in out:
-            break
-        time.sleep(interval)
+    # Every document is repeated by its own quantity, so the whole batch stays a single job
+    expanded = [document for document, quantity in documents for _ in range(max(1, quantity))]
+    job_id = cups.get_backend().submit(expanded, printer)
+    return [job_id] if isinstance(job_id, str) else []
 
 
-def _print_on_linux(filepath: str, printer: str, fmt: Tuple[int, int], orientation: str, quantity: int):
-    mode = config.get_option('linux_command', '-n')
-    if quantity == 1 or mode == "-n":
-        if quantity == 1:
-            subprocess.run(["lp", "-d", printer, filepath], check=True)
-        else:
-            subprocess.run(["lp", "-d", printer, "-n", str(quantity), filepath], check=True)
-    elif mode == "-o":
-        subprocess.run([
-            "lp",
-            "-d", printer,
-            "-o", f"copies={quantity}",
-            "-o", "Collate=true",
-            filepath
-        ], check=True)
-    else:
-        for _ in range(quantity):
-            subprocess.run(["lp", "-d", printer, filepath], check=True)
+def _print_on_linux(document: Document, printer: str, fmt: Tuple[int, int], orientation: str, quantity: int) -> Submission:
+    return _spool_on_linux([document], printer, lambda: _cups_submit_job(document, printer, quantity))
 
-    # Wait & Delete
-    job_id = _cups_submit_job(filepath, printer, quantity)
-    if isinstance(job_id, str):
-        _cups_wait_for_job_disappear(printer, job_id)
-    else:
-        time.sleep(2.0)
-    _safe_remove(filepath)
+
+def _spool_on_linux(documents: list[Document], printer: str, submit: Callable[[], list[str]]) -> Submission:
+    cleanup = [document.path for document in documents if document.temporary]
+    try:
+        job_ids = submit()
+    except Exception:
+        tracker.get_tracker(printer).track([], timeout=0, cleanup=cleanup)
+        raise
+    finally:
+        for document in documents:
+            document.close()
+
+    # Track & Delete
+    timeout = 5.0 if job_ids else 2.0
+    return Submission(job_ids, tracker.get_tracker(printer).track(job_ids, timeout=timeout, cleanup=cleanup))
 
 
 def _win32_list_job_ids(printer: str) -> set[int]:
@@ -239,48 +225,48 @@ def _print_on_windows(filepath: str, printer: str, fmt: Tuple[int, int], orienta
         filepath
     ], check=True)
 
-    # Wait & Delete
+    # Wait
     _win32_wait_for_spool(printer, known_ids, Path(filepath).name, timeout=5.0, interval=0.2)
-    _safe_remove(filepath)
 
 
-def list_printers():
-    if sys.platform == "win32":
-        return sorted([pr[2] for pr in win32print.EnumPrinters(2)], key=lambda s: s.lower())
-    try:
-        res = subprocess.run(["lpstat", "-e"], capture_output=True, text=True, timeout=3)
-        if res.returncode != 0:
-            return []
-        printers = [line.strip() for line in res.stdout.splitlines() if line.strip()]
-        return sorted(printers, key=lambda s: s.lower())
-    except Exception:
-        return []
+def _query_printers() -> list[str]:
+    with metrics.stage("lookup"):
+        if sys.platform == "win32":
+            return [pr[2] for pr in win32print.EnumPrinters(2)]
+        return cups.get_backend().list_printers()
+
+
+def get_inventory() -> PrinterInventory:
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            ttl = config.get_option("inventory.ttl", 30)
+            _inventory = PrinterInventory(_query_printers, float(30 if ttl is None else ttl))
+        return _inventory
+
+
+def list_printers(refresh: bool = False) -> list[str]:
+    return get_inventory().printers(refresh)
 
 
 def resolve_printer_name(printer_name: str) -> str:
-    printers = config.get_option("printers", {}) or {}
-    if printer_name in printers:
-        return printers[printer_name]
-    return printer_name
+    return config.get_snapshot().printers.get(printer_name, printer_name)
 
 
 def printer_exists(printer_name: str) -> bool:
     printer = resolve_printer_name(printer_name)
-    return True if printer in list_printers() else False
+    return get_inventory().exists(printer)
 
 
 def resolve_paper_format(paper_format: Union[str, Tuple[int, int]]) -> Tuple[int, int]:
     if isinstance(paper_format, str):
-        formats = config.get_option("formats", {}) or {}
-        fmt = formats.get(paper_format)
-        if not fmt:
+        snapshot = config.get_snapshot()
+        fmt = snapshot.formats.get(paper_format)
+        if fmt is None:
+            if paper_format in snapshot.format_errors:
+                raise ValueError(snapshot.format_errors[paper_format])
             raise ValueError(f"Unknown paper format '{paper_format}'.")
-        if not isinstance(fmt, (list, tuple)) or len(fmt) < 2:
-            raise ValueError(f"Invalid format entry for '{paper_format}' in config.")
-        width, height = fmt[0], fmt[1]
-        if not (isinstance(width, (int, float)) and isinstance(height, (int, float))):
-            raise ValueError(f"Invalid numeric values in format '{paper_format}'.")
-        return width, height
+        return fmt
     elif isinstance(paper_format, (tuple, list)) and len(paper_format) == 2:
         width, height = paper_format
         if not (isinstance(width, (int, float)) and isinstance(height, (int, float))):
@@ -290,15 +276,12 @@ def resolve_paper_format(paper_format: Union[str, Tuple[int, int]]) -> Tuple[int
         raise TypeError("paper_format must be a string or a tuple of two numbers.")
 
 
-def print_file(
-    filepath: str,
+def prepare_job(
     printer_name: str,
     paper_format: Union[str, Tuple[int, int]],
     orientation: str = 'portrait',
     quantity: int = 1
-):
-    if not os.path.exists(filepath):
-        raise FileNotFoundError(f"The filepath: '{filepath}' does not exist.")
+) -> Tuple[str, Tuple[int, int], str, int]:
     if orientation.lower() not in ('portrait', 'p', 'landscape', 'l',):
         raise ValueError(f"Unknown orientation '{orientation}' (use 'portrait', 'P' or 'landscape', 'L').")
 
@@ -309,40 +292,76 @@ def print_file(
     fmt = resolve_paper_format(paper_format)
     orientation = 'portrait' if orientation.lower() in ('portrait','p',) else 'landscape'
     quantity = 1 if quantity <= 1 else quantity
+    return printer, fmt, orientation, quantity
 
+
+def spool_document(
+    document: Document,
+    printer: str,
+    paper_format: Union[str, Tuple[int, int]],
+    fmt: Tuple[int, int],
+    orientation: str,
+    quantity: int
+) -> Submission:
     if sys.platform == "win32":
         settings = []
         if isinstance(paper_format, str):
             settings.append(f"paper={paper_format}")
-        _print_on_windows(filepath, printer, fmt, orientation, quantity, settings)
-    else:
-        _print_on_linux(filepath, printer, fmt, orientation, quantity)
 
+        # SumatraPDF requires a file on disk, in-memory documents get a unique file in the spool directory
+        manager = spool.get_spool()
+        if document.in_memory:
+            try:
+                filepath = manager.create(document)
+            finally:
+                document.close()
+        else:
+            filepath = document.path
+        try:
+            _print_on_windows(filepath, printer, fmt, orientation, quantity, settings)
+        finally:
+            if document.in_memory or document.temporary:
+                manager.release(filepath)
+        return Submission()
+    return _print_on_linux(document, printer, fmt, orientation, quantity)
 
-def _wrap_text(line: dict, pdf, max_width: float) -> list[dict]:
-    text = str(line.get("text", "") or "")
-    words: list[str] = text.split()
-    current_line = ""
-    result: list[dict] = []
 
-    for word in words:
-        test_line = (current_line + " " + word).strip()
-        line_width = pdf.get_string_width(test_line)
-        if line_width <= max_width:
-            current_line = test_line
-        else:
-            if current_line:
-                new_line = dict(line)
-                new_line["text"] = current_line
-                result.append(new_line)
-            current_line = word
+def spool_documents(
+    documents: list[Tuple[Document, int]],
+    printer: str,
+    paper_format: Union[str, Tuple[int, int]],
+    fmt: Tuple[int, int],
+    orientation: str
+) -> Submission:
+    if len(documents) == 1:
+        document, quantity = documents[0]
+        return spool_document(document, printer, paper_format, fmt, orientation, quantity)
 
-    if current_line:
-        new_line = dict(line)
-        new_line["text"] = current_line
-        result.append(new_line)
+    if sys.platform == "win32":
+        # SumatraPDF prints one file per call
+        for i, (document, quantity) in enumerate(documents):
+            try:
+                spool_document(document, printer, paper_format, fmt, orientation, quantity)
+            except Exception:
+                for remaining, _ in documents[i + 1:]:
+                    remaining.close()
+                raise
+        return Submission()
+    return _spool_on_linux([document for document, _ in documents], printer, lambda: _cups_submit_batch(documents, printer))
+
+
+def print_file(
+    filepath: str,
+    printer_name: str,
+    paper_format: Union[str, Tuple[int, int]],
+    orientation: str = 'portrait',
+    quantity: int = 1
+):
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"The filepath: '{filepath}' does not exist.")
 
-    return result
+    printer, fmt, orientation, quantity = prepare_job(printer_name, paper_format, orientation, quantity)
+    spool_document(Document.from_path(filepath, temporary=True), printer, paper_format, fmt, orientation, quantity).wait()
 
 
 def print_lines(
@@ -355,88 +374,6 @@ def print_lines(
     font_size: int = 10,
     line_height: int = 12,
 ):
-    if orientation.lower() not in ('portrait', 'p', 'landscape', 'l',):
-        raise ValueError(f"Unknown orientation '{orientation}' (use 'portrait', 'P' or 'landscape', 'L').")
-
-    printer = resolve_printer_name(printer_name)
-    if not printer_exists(printer):
-        raise ValueError(f"The printer '{printer_name}' does not exist no this system.")
-
-    fmt = resolve_paper_format(paper_format)
-    orientation = 'portrait' if orientation.lower() in ('portrait','p',) else 'landscape'
-    quantity = 1 if quantity <= 1 else quantity
-
-    # Temporary File
-    tmpdir = tempfile.gettempdir()
-    timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-    filepath = os.path.join(tmpdir, f"custom_label-{timestamp}.pdf")
-
-    # Page dimensions
-    width_mm, height_mm = fmt
-    font_name = font_name if isinstance(font_name, str) else 'helvetica'
-
-    # Create FPDF-Document
-    pdf = FPDF(
-        orientation='P' if orientation == 'portrait' else 'L',
-        unit='mm',
-        format=(width_mm, height_mm),
-    )
-    pdf.set_auto_page_break(False)
-    pdf.add_page()
-    pdf.set_text_color(0, 0, 0)
-    pdf.set_font(font_name, size=font_size)
-
-    # Wrap Text
-    margin_mm = 2.0
-    max_text_width_mm = width_mm - 2 * margin_mm
-    wrapped_lines: list[dict] = []
-    for line in lines:
-        wrapped_lines.extend(_wrap_text(line, pdf, max_text_width_mm))
-
-    # Vertical alignment
-    total_text_height_mm = 0.0
-    for line in wrapped_lines:
-        h = line.get("height", line_height)
-        if not isinstance(h, (int, float)):
-            h = line_height
-        total_text_height_mm += h * PT_TO_MM
-
-    y = (height_mm - total_text_height_mm) / 2 + font_size * PT_TO_MM
-
-    # Write lines
-    for line in wrapped_lines:
-        text = str(line.get("text", "") or "")
-        font = line.get("font", font_name if isinstance(font_name, str) else 'Helvetica')
-        size = line.get("size", font_size)
-        height = line.get("height", line_height)
-        if not isinstance(height, (int, float)):
-            height = line_height
-        line_step_mm = height * PT_TO_MM
-        text_width_mm = pdf.get_string_width(text)
-        x = (width_mm - text_width_mm) / 2
-
-        style = ""
-        if line.get("bold", False):
-            style += "B"
-        if line.get("italic", False):
-            style += "I"
-        if line.get("strikethrough", False):
-            style += "S"
-        if line.get("underline", False):
-            style += "U"
-
-        pdf.set_font(font, style=style, size=size)
-        pdf.text(x=x, y=y, txt=text)
-
-        y += line_step_mm
-
-    pdf.output(filepath)
-
-    # Print
-    if sys.platform == "win32":
-        settings = []
-        if isinstance(paper_format, str):
-            settings.append(f"paper={paper_format}")
-        _print_on_windows(filepath, printer, fmt, orientation, quantity, settings)
-    else:
-        _print_on_linux(filepath, printer, fmt, orientation, quantity)
+    printer, fmt, orientation, quantity = prepare_job(printer_name, paper_format, orientation, quantity)
+    document = Document.from_bytes(labels.label_name(), labels.render_lines(lines, fmt, orientation, font_name, font_size, line_height))
+    spool_document(document, printer, paper_format, fmt, orientation, quantity).wait()
@@ -1,21 +1,203 @@
+import io
 import json
+import logging
 import os
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, copy_current_request_context, g, request, jsonify
 from pathlib import Path
-from waitress import serve
-from . import printer
+from typing import Callable
+from waitress import create_server
+from werkzeug.exceptions import RequestEntityTooLarge
+from . import fonts, jobs, labels, metrics, printer, spool, tracker
+from .documents import Document, SpoolStream, UnsupportedDocument, PDF_MAGIC, SHA256_PATTERN, get_store
 from .. import config
 from ..version import __NAME__, __VERSION__
 from ..utils import is_int
 
-app = Flask(__name__)
-
 ROOT_PATH = Path(__file__).resolve().parents[3]
 TEMP_PATH = ROOT_PATH / "temp"
 os.makedirs(TEMP_PATH, exist_ok=True)
 
 
+class PexRequest(Request):
+    @property
+    def max_content_length(self) -> int | None:
+        size = config.get_option("uploads.max_size", 64 * 1024 * 1024)
+        return int(size) if size else None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Uploads stay in memory up to uploads.memory_limit and spill into an anonymous file in the spool directory above
+        return SpoolStream(
+            int(config.get_option("uploads.memory_limit", 4 * 1024 * 1024) or 0),
+            str(spool.get_spool().directory),
+            config.get_option("uploads.require_pdf", True) is not False
+        )
+
+
+app = Flask(__name__)
+app.request_class = PexRequest
+
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+UPLOAD_PATHS = ("/pex/print", "/pex/print/batch")
+SERVER_TIMING_STAGES = ("parse", "config", "lookup", "queue", "render", "spool", "wait")
+
+access_log = logging.getLogger("pex.requests")
+_dispatcher = None
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+REQUESTS = metrics.counter("pex_http_requests_total", "Handled HTTP requests.", ("endpoint", "method", "status"))
+REQUEST_SECONDS = metrics.histogram("pex_http_request_duration_seconds", "HTTP request latency.", ("endpoint", "method"))
+
+
+def _temp_size() -> dict:
+    # Sizes come from the bookkeeping of the document store and the spool manager, scrapes do not walk the disk
+    store = get_store()
+    return {
+        'documents': store.stats()['size'] if store is not None else 0,
+        'spool': spool.get_spool().stats()['size'],
+    }
+
+
+def _cache_stats() -> dict:
+    result = {}
+    render_cache = labels.get_render_cache()
+    if render_cache is not None:
+        result['render'] = render_cache.stats()
+    store = get_store()
+    if store is not None:
+        result['documents'] = store.stats()
+    return result
+
+
+def _dispatcher_threads() -> dict:
+    if _dispatcher is None:
+        return {}
+    threads = len(_dispatcher.threads)
+    return {
+        'threads': threads,
+        'busy': _dispatcher.active_count,
+        'backlog': len(_dispatcher.queue),
+        'utilization': _dispatcher.active_count / threads if threads else None,
+    }
+
+
+metrics.gauge("pex_http_requests_in_flight", "HTTP requests currently being handled.", lambda: _in_flight)
+metrics.gauge("pex_server_threads", "Waitress worker threads.", lambda: _dispatcher_threads().get('threads'))
+metrics.gauge("pex_server_threads_busy", "Waitress worker threads handling a request.", lambda: _dispatcher_threads().get('busy'))
+metrics.gauge("pex_server_thread_utilization", "Ratio of busy Waitress worker threads.", lambda: _dispatcher_threads().get('utilization'))
+metrics.gauge("pex_server_backlog", "Requests waiting for a Waitress worker thread.", lambda: _dispatcher_threads().get('backlog'))
+metrics.gauge("pex_temp_dir_bytes", "Bytes held in the temp directory by the document store and the spool.", _temp_size, ("area",))
+metrics.gauge("pex_spool_bytes", "Size of the documents held in the spool directory.", lambda: spool.get_spool().stats()['size'])
+metrics.gauge("pex_jobs_queued", "Queued print jobs per printer.", lambda: jobs.get_queue().stats()['queued'], ("printer",))
+metrics.gauge("pex_jobs_active", "Running print jobs per printer.", lambda: jobs.get_queue().stats()['active'], ("printer",))
+metrics.gauge("pex_tracker_pending", "Spooled jobs awaiting completion per printer.", lambda: {
+    name: stats['pending'] for name, stats in tracker.stats().items()
+}, ("printer",))
+metrics.counter_callback("pex_tracker_polls_total", "Completion polls per printer.", lambda: {
+    name: stats['polls'] for name, stats in tracker.stats().items()
+}, ("printer",))
+metrics.counter_callback("pex_cache_hits_total", "Cache hits.", lambda: {
+    name: stats['hits'] for name, stats in _cache_stats().items()
+}, ("cache",))
+metrics.counter_callback("pex_cache_misses_total", "Cache misses.", lambda: {
+    name: stats['misses'] for name, stats in _cache_stats().items()
+}, ("cache",))
+metrics.gauge("pex_cache_hit_ratio", "Cache hit ratio since start.", lambda: {
+    name: stats['hits'] / (stats['hits'] + stats['misses'])
+    for name, stats in _cache_stats().items() if stats['hits'] + stats['misses']
+}, ("cache",))
+metrics.gauge("pex_cache_size_bytes", "Cache size.", lambda: {
+    name: stats['size'] for name, stats in _cache_stats().items()
+}, ("cache",))
+metrics.counter_callback("pex_inventory_refreshes_total", "Printer inventory refreshes.", lambda: printer.get_inventory().stats()['refreshes'])
+
+
+@app.before_request
+def _start_request():
+    global _in_flight
+    g.started = time.perf_counter()
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+    g.trace = metrics.trace_begin()
+    g.jobs = []
+    with _in_flight_lock:
+        _in_flight += 1
+
+    # Uploads to a printer named in the URL are checked against its byte budget before the body is parsed
+    printer_name = request.args.get('printer')
+    admit_upload(request.path, printer_name, request.content_length)
+
+    # Parse uploads up front, so the parse stage is measured apart from the endpoint itself
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        with metrics.stage("parse"):
+            files = request.files
+        if not printer_name and files:
+            size = sum(getattr(file.stream, 'size', 0) for file in files.values())
+            admit_upload(request.path, request.form.get('printer') or config.get_option('printer_default'), size)
+
+
+def admit_upload(path: str, printer_name: str | None, size: int | None):
+    # Uploads which do not fit into the remaining byte budget of their printer are rejected before they are stored
+    if path in UPLOAD_PATHS and size and printer_name:
+        jobs.admit_upload(printer_name, size)
+
+
+@app.after_request
+def _finish_request(response):
+    # Deferred responses are finished (and logged) once their jobs are done, see respond_after
+    if g.get('deferred'):
+        return response
+
+    duration = time.perf_counter() - g.get('started', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    REQUESTS.inc(endpoint, request.method, str(response.status_code))
+    REQUEST_SECONDS.observe(duration, endpoint, request.method)
+
+    # Finished jobs add the stages that ran in the job worker to the breakdown of the request
+    timings = dict(g.get('trace') or {})
+    for job in g.get('jobs', []):
+        if job.finished:
+            for name, value in dict(job.stages).items():
+                timings[name] = timings.get(name, 0.0) + value
+
+    request_id = g.get('request_id') or uuid.uuid4().hex
+    response.headers['X-Request-ID'] = request_id
+    response.headers['Server-Timing'] = ", ".join(
+        [f"{name};dur={timings[name] * 1000:.1f}" for name in SERVER_TIMING_STAGES if name in timings]
+        + [f"total;dur={duration * 1000:.1f}"]
+    )
+
+    if config.get_option("server.access_log", True) is not False:
+        access_log.info(json.dumps({
+            'request_id': request_id,
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'timings_ms': {name: round(value * 1000, 2) for name, value in timings.items()},
+            'jobs': [job.id for job in g.get('jobs', [])],
+        }))
+    return response
+
+
+@app.teardown_request
+def _teardown_request(_):
+    global _in_flight
+    metrics.trace_end()
+    if g.get('deferred'):
+        return
+    with _in_flight_lock:
+        _in_flight -= 1
+
+
 @app.after_request
 def apply_cors_headers(response):
     origin = config.get_option("server.cors")
@@ -29,6 +211,8 @@ def apply_cors_headers(response):
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, PATCH, DELETE, OPTIONS'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         response.headers['Access-Control-Allow-Credentials'] = 'true'
+        response.headers['Access-Control-Expose-Headers'] = 'X-Request-ID, Server-Timing, Retry-After'
+        response.headers['Timing-Allow-Origin'] = origin
     return response
 
 
@@ -47,8 +231,123 @@ def response_error(message: str, details: dict | None = None, code: int = 400):
     }), code
 
 
+@app.errorhandler(UnsupportedDocument)
+def _handle_unsupported_document(e):
+    return response_error(str(e), code=415)
+
+
+@app.errorhandler(jobs.QueueFull)
+def _handle_queue_full(e):
+    response, code = response_error(str(e), {**e.details, 'retry_after': e.retry_after}, 429)
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, code
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def _handle_too_large(e):
+    return response_error("The request body exceeds the configured maximum upload size.", {
+        'max_size': request.max_content_length
+    }, 413)
+
+
+def request_flag(name: str) -> bool:
+    data = request.get_json(silent=True) if request.is_json else None
+    value = data.get(name) if isinstance(data, dict) and name in data else request.values.get(name, '')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def upload_document(file) -> Document:
+    timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+    filename = os.path.basename(file.filename or f"custom_file-{timestamp}.pdf").replace(' ', '_')
+
+    # The job takes over the spooled upload, so it outlives the request
+    stream = file.stream
+    file.stream = io.BytesIO()
+    if not isinstance(stream, SpoolStream):
+        document = Document.from_bytes(filename, stream.read())
+        stream.close()
+    else:
+        document = Document.from_stream(filename, stream)
+    if config.get_option("uploads.require_pdf", True) is not False and not document.head().startswith(PDF_MAGIC):
+        document.close()
+        raise UnsupportedDocument("The uploaded file is not a PDF document.")
+    return document
+
+
+def share_document(document: Document, count: int) -> list[Document]:
+    # Every job closes its own handle, so each use of the upload gets one
+    if count <= 1:
+        return [document]
+    try:
+        store = get_store()
+        if store is not None and store.put(document):
+            shared = [store.get(document.digest, document.name) for _ in range(count)]
+            if None not in shared:
+                return shared
+            for handle in shared:
+                if handle is not None:
+                    handle.close()
+        data = b"".join(document.chunks())
+    finally:
+        document.close()
+    return [Document(document.name, io.BytesIO(data), document.size, digest=document.digest) for _ in range(count)]
+
+
+def stored_document(digest: str) -> Document | None:
+    digest = str(digest or '').strip().lower()
+    store = get_store()
+    return store.get(digest) if store is not None and SHA256_PATTERN.match(digest) else None
+
+
+def respond_after(waiting: list[jobs.Job], build: Callable):
+    if not request_flag('wait') or not waiting:
+        return build()
+    timeout = float(config.get_option("jobs.wait_timeout", 30) or 30)
+
+    defer = request.environ.get('pex.defer')
+    if defer is None:
+        deadline = time.monotonic() + timeout
+        for job in waiting:
+            job.wait(max(0.0, deadline - time.monotonic()))
+        return build()
+
+    # The asyncio server waits for the jobs on its event loop instead of a thread and calls finish afterwards
+    state = {name: g.get(name) for name in ('started', 'request_id', 'trace', 'jobs')}
+    g.deferred = True
+
+    @copy_current_request_context
+    def finish() -> Response:
+        for name, value in state.items():
+            setattr(g, name, value)
+        return app.process_response(app.make_response(build()))
+
+    defer(waiting, timeout, finish)
+    return Response(status=202)
+
+
+def response_job(job: jobs.Job, message: str, args: dict):
+    g.jobs.append(job)
+
+    def build():
+        if job.state == jobs.JOB_FAILED:
+            return response_error(job.error or "The print job failed.", {'job': job.to_dict(), 'arguments': args})
+        if job.state == jobs.JOB_DONE:
+            return response_success({
+                "message": message,
+                "job": job.to_dict(),
+                "arguments": args
+            })
+        return response_success({
+            "message": "The print job has been queued.",
+            "job": job.to_dict(),
+            "arguments": args
+        }, 202)
+    return respond_after([job], build)
+
+
 @app.route('/pex/status', methods=['GET'])
 def _get_status():
+    render_cache = labels.get_render_cache()
     return response_success({
         'name': __NAME__,
         'version': __VERSION__,
@@ -57,10 +356,21 @@ def _get_status():
             'printers': config.get_option('printers'),
             'printer_default': config.get_option('printer_default'),
         },
-        'printers': printer.list_printers()
+        'printers': printer.list_printers(),
+        'inventory': printer.get_inventory().stats(),
+        'render_cache': render_cache.stats() if render_cache is not None else None,
+        'render_processes': int(config.get_option('render.processes', 0) or 0),
+        'fonts': fonts.get_registry().stats(),
+        'jobs': jobs.get_queue().stats(),
+        'spool': spool.get_spool().stats(),
     })
 
 
+@app.route('/pex/metrics', methods=['GET'])
+def _get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/pex/printers', methods=['GET'])
 def _get_printers():
     printers = printer.list_printers()
@@ -78,9 +388,13 @@ def _post_print():
     args: dict = dict()
 
     # Default arguments
-    args['printer_name'] = request.form.get('printer', config.get_option('printer_default'))
+    args['printer_name'] = request.args.get('printer') or request.form.get('printer') or config.get_option('printer_default')
     args['orientation'] = request.form.get('orientation', 'portrait')
     args['quantity'] = int(request.form.get('quantity', 1))
+    try:
+        args['priority'] = jobs.parse_priority(request.form.get('priority'))
+    except ValueError as e:
+        return response_error(str(e), {'priority': request.form.get('priority')})
 
     # Format "paper_format"
     formats = request.form.getlist('format')
@@ -95,20 +409,35 @@ def _post_print():
             args['paper_format'] = formats[0]
 
     # Print PDF file
-    if 'file' in request.files:
+    if 'file' in request.files or 'sha256' in request.form:
         try:
-            file = request.files['file']
-            timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-            filename = os.path.basename(file.filename or f"custom_file-{timestamp}.pdf").replace(' ', '_')
-            filepath = os.path.join(TEMP_PATH, filename)
-            file.save(filepath)
-            args['filepath'] = filepath
-
-            printer.print_file(**args)
-            return response_success({
-                "message": "The file has been successfully printed.",
-                "arguments": args
-            })
+            if 'file' in request.files:
+                try:
+                    document = upload_document(request.files['file'])
+                except UnsupportedDocument as e:
+                    return response_error(str(e), {'filename': request.files['file'].filename}, 415)
+            else:
+                digest = str(request.form.get('sha256', '')).strip().lower()
+                document = stored_document(digest)
+                if document is None:
+                    return response_error("The document is unknown, please upload the file instead.", {'sha256': digest}, 404)
+            filename = document.name
+
+            args['filename'] = filename
+            args['size'] = document.size
+            args['sha256'] = document.digest
+
+            job = jobs.submit_file(
+                document,
+                args['printer_name'],
+                args['paper_format'],
+                args['orientation'],
+                args['quantity'],
+                args['priority']
+            )
+            return response_job(job, "The file has been successfully printed.", args)
+        except jobs.QueueFull:
+            raise
         except Exception as e:
             return response_error(str(e))
 
@@ -128,37 +457,16 @@ def _post_print():
                 except json.JSONDecodeError:
                     parsed = entry
 
-                if isinstance(parsed, str):
-                    lines.append({
-                        'text': parsed,
-                        'font': args['font_name'],
-                        'size': args['font_size'],
-                        'height': args['line_height'],
-                        'bold': False,
-                        'italic': False,
-                        'underline': False,
-                        'strikethrough': False,
-                    })
-                elif isinstance(parsed, dict):
-                    lines.append({
-                        'text': parsed.get('text', ''),
-                        'font': parsed.get('font', args['font_name']),
-                        'size': parsed.get('size', args['font_size']),
-                        'height': parsed.get('height', args['line_height']),
-                        'bold': parsed.get('bold', False),
-                        'italic': parsed.get('italic', False),
-                        'underline': parsed.get('underline', False),
-                        'strikethrough': parsed.get('strikethrough', False),
-                    })
-                else:
-                    return response_error("The lines structure is invalid or corrupt.", {'lines': lines})
+                try:
+                    lines.append(labels.normalize_line(parsed, args['font_name'], args['font_size'], args['line_height']))
+                except ValueError as e:
+                    return response_error(str(e), {'lines': lines})
             args["lines"] = lines
 
-            printer.print_lines(**args)
-            return response_success({
-                "message": "The label has been successfully printed.",
-                "arguments": args
-            })
+            job = jobs.submit_lines(**args)
+            return response_job(job, "The label has been successfully printed.", args)
+        except jobs.QueueFull:
+            raise
         except Exception as e:
             return response_error(str(e))
 
@@ -167,23 +475,318 @@ def _post_print():
         return response_error("You need to either pass a file or the desired lines to print.", request.form)
 
 
-def run():
+@app.route('/pex/print/template', methods=['POST'])
+def _post_print_template():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = request.form.to_dict()
+        try:
+            data['records'] = json.loads(data.get('records') or '[]')
+        except json.JSONDecodeError:
+            return response_error("The records must be a JSON array of objects.")
+
+    name = data.get('template')
+    records = data.get('records')
+    if not isinstance(name, str) or not name:
+        return response_error("You need to pass the name of the label template.", data)
+    if not isinstance(records, list) or not records:
+        return response_error("You need to pass at least one record for the label template.", data)
+
+    try:
+        template = labels.get_template(name)
+    except KeyError as e:
+        return response_error(str(e.args[0]), {'template': name}, 404)
+    except ValueError as e:
+        return response_error(str(e), {'template': name})
+
+    try:
+        args: dict = {
+            'printer_name': data.get('printer', config.get_option('printer_default')),
+            'paper_format': data.get('format', template.paper_format),
+            'orientation': data.get('orientation', template.orientation),
+            'quantity': int(data.get('quantity', 1)),
+            'priority': jobs.parse_priority(data.get('priority')),
+        }
+        pages = [template.fill(record) for record in records]
+        job = jobs.submit_pages(
+            pages,
+            **args,
+            font_name=template.font_name,
+            font_size=template.font_size,
+            line_height=template.line_height,
+            kind="template"
+        )
+        args['template'] = name
+        args['records'] = len(records)
+        return response_job(job, "The labels have been successfully printed.", args)
+    except jobs.QueueFull:
+        raise
+    except Exception as e:
+        return response_error(str(e))
+
+
+@app.route('/pex/print/batch', methods=['POST'])
+def _post_print_batch():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = request.form.to_dict()
+        try:
+            data['items'] = json.loads(data.get('items') or '[]')
+        except json.JSONDecodeError:
+            return response_error("The items must be a JSON array of objects.")
+
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return response_error("You need to pass at least one item to print.", data)
+
+    defaults = {
+        'printer_name': request.args.get('printer') or data.get('printer') or config.get_option('printer_default'),
+        'paper_format': data.get('format', "A4"),
+        'orientation': data.get('orientation', 'portrait'),
+        'font_name': data.get('font_name', None),
+        'font_size': data.get('font_size', 10),
+        'line_height': data.get('line_height', 12),
+    }
+    try:
+        priority = jobs.parse_priority(data.get('priority'))
+    except ValueError as e:
+        return response_error(str(e), {'priority': data.get('priority')})
+
+    # Each upload is read once, however many items print it
+    uses = Counter(str(item['file']) for item in items if isinstance(item, dict) and 'file' in item)
+    uploads: dict[str, list[Document] | Exception] = {}
+
+    # Compatible items (same printer, format and orientation) are merged into one job
+    results: list[dict] = []
+    groups: dict[tuple, dict] = {}
+    for index, item in enumerate(items):
+        result = {'index': index, 'type': None, 'job': None, 'state': jobs.JOB_FAILED, 'error': None}
+        results.append(result)
+        document = None
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("The batch items must be objects.")
+            paper_format = item.get('format', defaults['paper_format'])
+            if isinstance(paper_format, list):
+                paper_format = tuple(paper_format)
+            target, fmt, orientation, quantity = printer.prepare_job(
+                item.get('printer', defaults['printer_name']),
+                paper_format,
+                item.get('orientation', defaults['orientation']),
+                int(item.get('quantity', 1))
+            )
+
+            if 'lines' in item:
+                result['type'] = "lines"
+                font_name = item.get('font_name', defaults['font_name'])
+                font_size = int(item.get('font_size', defaults['font_size']))
+                line_height = int(item.get('line_height', defaults['line_height']))
+                if not isinstance(item['lines'], list) or not item['lines']:
+                    raise ValueError("The lines structure is invalid or corrupt.")
+                lines = [labels.normalize_line(line, font_name, font_size, line_height) for line in item['lines']]
+                group = groups.setdefault((target, tuple(fmt), orientation), {'paper_format': paper_format, 'entries': [], 'results': []})
+                settings = {'font_name': font_name, 'font_size': font_size, 'line_height': line_height}
+                last = group['entries'][-1][0] if group['entries'] else None
+                # Consecutive labels with the same font are rendered into one document
+                if isinstance(last, dict) and all(last[name] == value for name, value in settings.items()):
+                    last['pages'].extend([lines] * quantity)
+                else:
+                    group['entries'].append(({'pages': [lines] * quantity, **settings}, 1))
+            elif 'file' in item or 'sha256' in item:
+                result['type'] = "file"
+                if 'file' in item:
+                    field = str(item['file'])
+                    if field not in uploads:
+                        file = request.files.get(field)
+                        try:
+                            if file is None:
+                                raise ValueError(f"The file '{item['file']}' has not been uploaded with the batch.")
+                            uploads[field] = share_document(upload_document(file), uses[field])
+                        except Exception as e:
+                            uploads[field] = e
+                    if isinstance(uploads[field], Exception):
+                        raise uploads[field]
+                    document = uploads[field].pop()
+                else:
+                    document = stored_document(item['sha256'])
+                    if document is None:
+                        raise ValueError("The document is unknown, please upload the file instead.")
+                result['filename'] = document.name
+                result['sha256'] = document.digest
+                group = groups.setdefault((target, tuple(fmt), orientation), {'paper_format': paper_format, 'entries': [], 'results': []})
+                group['entries'].append((document, quantity))
+            else:
+                raise ValueError("You need to either pass a file, a sha256 or the desired lines to print.")
+            group['results'].append(result)
+        except Exception as e:
+            if document is not None:
+                document.close()
+            result['error'] = str(e)
+    # Handles of items that failed before taking theirs
+    for shared in uploads.values():
+        if not isinstance(shared, Exception):
+            for document in shared:
+                document.close()
+
+    batch_jobs: list[jobs.Job] = g.jobs
+    rejected: jobs.QueueFull | None = None
+    for (target, _, orientation), group in groups.items():
+        try:
+            entries = group['entries']
+            if len(entries) == 1 and isinstance(entries[0][0], dict):
+                labels_entry = entries[0][0]
+                job = jobs.submit_pages(
+                    labels_entry['pages'],
+                    target,
+                    group['paper_format'],
+                    orientation,
+                    1,
+                    labels_entry['font_name'],
+                    labels_entry['font_size'],
+                    labels_entry['line_height'],
+                    kind="batch",
+                    priority=priority
+                )
+            else:
+                job = jobs.submit_documents(entries, target, group['paper_format'], orientation, priority=priority)
+        except Exception as e:
+            if isinstance(e, jobs.QueueFull):
+                rejected = e
+            for result in group['results']:
+                result['error'] = str(e)
+            continue
+        batch_jobs.append(job)
+        for result in group['results']:
+            result['job'] = job
+
+    if rejected is not None and not batch_jobs:
+        raise rejected
+
+    def build():
+        for result in results:
+            job = result['job']
+            if isinstance(job, jobs.Job):
+                result['job'] = job.id
+                result['state'] = job.state
+                result['error'] = job.error
+
+        details = {'jobs': [job.to_dict() for job in batch_jobs], 'items': results}
+        if all(result['state'] == jobs.JOB_FAILED for result in results):
+            return response_error("None of the batch items could be printed.", details)
+        if any(not job.finished for job in batch_jobs):
+            return response_success({"message": "The batch has been queued.", **details}, 202)
+        if any(result['state'] == jobs.JOB_FAILED for result in results):
+            return response_success({"message": "The batch has been printed, some items failed.", **details})
+        return response_success({"message": "The batch has been successfully printed.", **details})
+    return respond_after(batch_jobs, build)
+
+
+@app.route('/pex/documents/<digest>', methods=['HEAD'])
+def _head_document(digest: str):
+    digest = digest.lower()
+    if not SHA256_PATTERN.match(digest):
+        return "", 400
+    store = get_store()
+    size = store.contains(digest) if store is not None else None
+    if size is None:
+        return "", 404
+    return "", 200, {'X-Document-Size': str(size)}
+
+
+@app.route('/pex/jobs', methods=['GET'])
+def _get_jobs():
+    printer_name = request.args.get('printer') or None
+    state = request.args.get('state') or None
+    if state is not None and state not in jobs.JOB_STATES:
+        return response_error(f"Unknown job state '{state}'.", {'states': list(jobs.JOB_STATES)})
+    try:
+        since = float(request.args['since']) if request.args.get('since') else None
+        limit = min(max(int(request.args.get('limit') or 100), 1), 1000)
+        after = None
+        if request.args.get('cursor'):
+            created_at, job_id = request.args['cursor'].split(":", 1)
+            after = (float(created_at), job_id)
+    except ValueError:
+        return response_error("The parameters 'since', 'limit' and 'cursor' are invalid.")
+    if printer_name is not None:
+        printer_name = printer.resolve_printer_name(printer_name)
+
+    found, cursor = jobs.get_queue().list_jobs(printer_name, state, since, after, limit)
+    return response_success({
+        'jobs': found,
+        'next': f"{cursor[0]!r}:{cursor[1]}" if cursor is not None else None,
+    })
+
+
+@app.route('/pex/jobs/<job_id>', methods=['GET'])
+def _get_job(job_id: str):
+    job = jobs.get_queue().find(job_id)
+    if job is None:
+        return response_error(f"The job '{job_id}' does not exist.", {'id': job_id}, 404)
+    return response_success({
+        'job': job
+    })
+
+
+def supervise(serve: Callable[[socket.socket, dict], None]) -> bool:
+    workers = int(config.get_option("server.workers") or 1)
+    if workers <= 1:
+        return False
+    if not hasattr(os, "fork"):
+        print("The 'server.workers' option requires a platform with fork, serving from a single process.")
+        return False
+
+    from .supervisor import Supervisor
+    # Fonts are parsed before forking, so the workers share them; threads and the job store start per worker
+    fonts.get_registry().load()
+    Supervisor(
+        workers,
+        config.get_option("server.host") or "0.0.0.0",
+        int(config.get_option("server.port") or 4422),
+        int(config.get_option("server.backlog") or 128)
+    ).run(serve)
+    return True
+
+
+def prepare(recover: dict | None = None):
+    printer.get_inventory().start()
+    fonts.get_registry().load()
+    labels.warm_render_pool()
+    spool.get_spool().start()
+    requeued, failed = jobs.get_queue().recover(**(recover or {}))
+    if requeued or failed:
+        print(f"Recovered {requeued} unfinished job(s), {failed} could not be restored.")
+
+    logging.basicConfig()
+    if not access_log.handlers:
+        access_log.addHandler(logging.StreamHandler())
+        access_log.setLevel(logging.INFO)
+        access_log.propagate = False
+
+
+def run(sock: socket.socket | None = None, recover: dict | None = None):
+    if sock is None and supervise(run):
+        return
     host = config.get_option("server.host") or "0.0.0.0"
     port = int(config.get_option("server.port") or 4422)
     threads = int(config.get_option("server.threads") or 4)
     backlog = int(config.get_option("server.backlog") or 128)
     channel_timeout = int(config.get_option("server.timeout") or 30)
+    prepare(recover)
 
+    global _dispatcher
     try:
-        serve(
+        listen = {'sockets': [sock]} if sock is not None else {'host': host, 'port': port, 'backlog': backlog}
+        server = create_server(
             app,
-            host=host,
-            port=port,
+            **listen,
             threads=threads,
-            backlog=backlog,
             channel_timeout=channel_timeout,
             ident=f"PEX/{__VERSION__}"
         )
+        _dispatcher = server.task_dispatcher
+        server.print_listen("Serving on http://{}:{}")
+        server.run()
     except ImportError:
         app.run(debug=True, host=config.get_option("server.host"), port=config.get_option("server.port"))
 
@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+from .documents import Document
+from .. import config
+
+ROOT_PATH = Path(__file__).resolve().parents[3]
+SPOOL_PATH = ROOT_PATH / "temp" / "spool"
+
+# Spool files are named "<pid>-<uuid>.pdf", the process ID tells the janitor whether the owner is still alive
+SPOOL_FILE_PATTERN = re.compile(r"^(\d+)-[0-9a-f]{32}\.pdf$")
+
+
+class SpoolFull(Exception):
+    pass
+
+
+def _pid_alive(pid: int) -> bool:
+    # Only a single server process runs on Windows, files of other processes are always orphans
+    if sys.platform == "win32":
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SpoolManager:
+    def __init__(self, directory: str | Path, max_size: int = 0, max_age: float = 3600, interval: float = 60, memfd: bool = False):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.interval = interval
+        self.memfd = memfd
+        self.reclaimed = 0
+        self._files: dict[str, int] = {}
+        self._trash: set[str] = set()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _reserve(self, size: int):
+        with self._lock:
+            if self.max_size and self._size + size > self.max_size:
+                raise SpoolFull(f"The spool directory is full ({self._size} of {self.max_size} bytes in use).")
+            self._size += size
+
+    def _unreserve(self, size: int):
+        with self._lock:
+            self._size -= size
+
+    def create(self, document: Document) -> str:
+        self._reserve(document.size)
+        path = str(self.directory / f"{os.getpid()}-{uuid.uuid4().hex}.pdf")
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o600)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in document.chunks():
+                        f.write(chunk)
+            except BaseException:
+                os.unlink(path)
+                raise
+        except BaseException:
+            self._unreserve(document.size)
+            raise
+        with self._lock:
+            self._files[path] = document.size
+        return path
+
+    def release(self, path: str):
+        with self._lock:
+            self._size -= self._files.pop(path, 0)
+        # Files which cannot be removed yet (e.g. still opened by the print program on Windows) are left to the janitor
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            with self._lock:
+                self._trash.add(path)
+            self._wake.set()
+
+    def _create_memfd(self, document: Document) -> int:
+        self._reserve(document.size)
+        try:
+            fd = os.memfd_create("pex-spool")
+            try:
+                with os.fdopen(fd, "wb", closefd=False) as f:
+                    for chunk in document.chunks():
+                        f.write(chunk)
+            except BaseException:
+                os.close(fd)
+                raise
+        except BaseException:
+            self._unreserve(document.size)
+            raise
+        return fd
+
+    @contextmanager
+    def files(self, documents: list[Document]) -> Iterator[tuple[list[str], list[int]]]:
+        # In-memory documents are written to the spool (or to anonymous memory files) for programs which take paths
+        memfd = self.memfd and hasattr(os, "memfd_create")
+        created: dict[int, tuple[str, int | None, int]] = {}
+        try:
+            paths = []
+            for document in documents:
+                if document.in_memory and id(document) not in created:
+                    if memfd:
+                        fd = self._create_memfd(document)
+                        created[id(document)] = (f"/dev/fd/{fd}", fd, document.size)
+                    else:
+                        created[id(document)] = (self.create(document), None, 0)
+                entry = created.get(id(document))
+                paths.append(entry[0] if entry is not None else document.path)
+            yield paths, [fd for _, fd, _ in created.values() if fd is not None]
+        finally:
+            for path, fd, size in created.values():
+                if fd is None:
+                    self.release(path)
+                else:
+                    os.close(fd)
+                    self._unreserve(size)
+
+    def sweep(self) -> int:
+        with self._lock:
+            trash = list(self._trash)
+            live = set(self._files)
+        removed = 0
+        for path in trash:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            removed += 1
+            with self._lock:
+                self._trash.discard(path)
+
+        # Orphans are left behind by crashed processes, stale files of this process by lost references.
+        # Files of other live workers may still be printing, only their owner knows which of them are in use.
+        pid = os.getpid()
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            m = SPOOL_FILE_PATTERN.match(entry.name)
+            if not m or entry.path in live:
+                continue
+            owner = int(m.group(1))
+            if owner != pid:
+                if _pid_alive(owner):
+                    continue
+            else:
+                try:
+                    if now - entry.stat().st_mtime <= self.max_age:
+                        continue
+                except FileNotFoundError:
+                    continue
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self.reclaimed += removed
+        return removed
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="pex-spool-janitor", daemon=True)
+        self.sweep()
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            # Files which could not be removed yet are retried every second, orphans once per interval
+            self._wake.wait(1.0 if self._trash else self.interval)
+            self._wake.clear()
+            try:
+                self.sweep()
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'path': str(self.directory),
+                'files': len(self._files),
+                'size': self._size,
+                'max_size': self.max_size,
+                'memfd': self.memfd and hasattr(os, "memfd_create"),
+                'trash': len(self._trash),
+                'reclaimed': self.reclaimed,
+            }
+
+
+_spool: SpoolManager | None = None
+_spool_lock = threading.Lock()
+
+
+def get_spool() -> SpoolManager:
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            # Point spool.path at a tmpfs mount (e.g. /dev/shm/pex) to keep spooled documents off the disk
+            path = Path(config.get_option("spool.path", "") or SPOOL_PATH)
+            _spool = SpoolManager(path if path.is_absolute() else ROOT_PATH / path)
+        _spool.max_size = int(config.get_option("spool.max_size", 256 * 1024 * 1024) or 0)
+        _spool.max_age = float(config.get_option("spool.max_age", 3600) or 3600)
+        _spool.interval = float(config.get_option("spool.janitor_interval", 60) or 60)
+        _spool.memfd = config.get_option("spool.memfd", False) is True
+        return _spool
@@ -0,0 +1,73 @@
+import os
+import signal
+import socket
+import time
+import traceback
+from typing import Callable
+
+RESTART_DELAY = 1.0
+
+
+class Supervisor:
+    def __init__(self, workers: int, host: str, port: int, backlog: int = 128):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.stopping = False
+        self._sock: socket.socket | None = None
+        self._children: dict[int, tuple[int, float]] = {}
+
+    def _spawn(self, serve: Callable[[socket.socket, dict], None], index: int, recover: dict):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 0
+            try:
+                serve(self._sock, recover)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self._children[pid] = (index, time.monotonic())
+
+    def _stop(self, *_):
+        self.stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self, serve: Callable[[socket.socket, dict], None]):
+        # The listener is bound once and inherited, the kernel hands each connection to one of the workers
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self._sock = socket.create_server((self.host, self.port), family=family, backlog=self.backlog)
+        started = time.time()
+
+        # Only the first worker restores the jobs of the previous run, the others start empty
+        for index in range(self.workers):
+            self._spawn(serve, index, {'before': started} if index == 0 else {'owners': []})
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        print(f"Started {self.workers} workers on http://{self.host}:{self.port}")
+
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index, spawned = self._children.pop(pid, (None, 0.0))
+            if self.stopping or index is None:
+                continue
+
+            # Crashed workers are replaced, the new worker takes over the queued jobs of the old one
+            print(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting.")
+            if time.monotonic() - spawned < RESTART_DELAY:
+                time.sleep(RESTART_DELAY)
+            self._spawn(serve, index, {'owners': [pid]})
+        self._sock.close()
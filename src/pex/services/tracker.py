@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from . import cups
+
+
+class _Pending:
+    def __init__(self, job_ids: list[str], deadline: float, cleanup: list[str]):
+        self.job_ids = set(job_ids)
+        self.deadline = deadline
+        self.cleanup = cleanup
+        self.future: Future = Future()
+
+
+class PrinterTracker:
+    def __init__(self, printer: str, min_interval: float = 0.2, max_interval: float = 2.0, attempts: int = 5):
+        self.printer = printer
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.attempts = attempts
+        self._pending: list[_Pending] = []
+        self._trash: dict[str, int] = {}
+        self._interval = min_interval
+        self._cond = threading.Condition()
+        self._polls = 0
+        self._thread = threading.Thread(target=self._run, name=f"pex-tracker-{printer}", daemon=True)
+        self._thread.start()
+
+    def track(self, job_ids: list[str], timeout: float = 5.0, cleanup: list[str] | None = None) -> Future:
+        pending = _Pending(job_ids, time.monotonic() + timeout, list(cleanup or []))
+        with self._cond:
+            self._pending.append(pending)
+            self._interval = self.min_interval
+            self._cond.notify()
+        return pending.future
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                'trash': len(self._trash),
+                'interval': round(self._interval, 3),
+                'polls': self._polls,
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._trash:
+                    self._cond.wait()
+                pending = list(self._pending)
+
+            # One poll resolves every outstanding job of this printer
+            active = None
+            if any(p.job_ids for p in pending):
+                try:
+                    active = cups.get_backend().active_jobs(self.printer)
+                    self._polls += 1
+                except Exception:
+                    active = None
+
+            now = time.monotonic()
+            resolved = []
+            for p in pending:
+                if p.job_ids and active is not None and not (p.job_ids & active):
+                    resolved.append((p, True))
+                elif now >= p.deadline:
+                    resolved.append((p, False))
+
+            with self._cond:
+                for p, _ in resolved:
+                    self._pending.remove(p)
+                    for path in p.cleanup:
+                        self._trash.setdefault(path, 0)
+                self._interval = self.min_interval if resolved else min(self._interval * 1.5, self.max_interval)
+                interval = self._interval
+
+            for p, done in resolved:
+                p.future.set_result(done)
+            self._empty_trash()
+
+            with self._cond:
+                if self._pending or self._trash:
+                    next_deadline = min((p.deadline for p in self._pending), default=now + interval)
+                    self._cond.wait(max(0.0, min(interval, next_deadline - time.monotonic())))
+
+    def _empty_trash(self):
+        with self._cond:
+            trash = list(self._trash.items())
+
+        for path, attempts in trash:
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError:
+                removed = True
+            except OSError:
+                removed = attempts + 1 >= self.attempts
+
+            with self._cond:
+                if removed:
+                    self._trash.pop(path, None)
+                else:
+                    self._trash[path] = attempts + 1
+
+
+_trackers: dict[str, PrinterTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(printer: str) -> PrinterTracker:
+    with _trackers_lock:
+        tracker = _trackers.get(printer)
+        if tracker is None:
+            tracker = _trackers[printer] = PrinterTracker(printer)
+        return tracker
+
+
+def stats() -> dict:
+    with _trackers_lock:
+        trackers = dict(_trackers)
+    return {printer: tracker.stats() for printer, tracker in trackers.items()}
@@ -9,7 +9,7 @@ class PrintersEditor(tk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
 
-        self._printers = printer.list_printers() or []
+        self._printers = printer.list_printers(refresh=True) or []
         self._default = tk.StringVar(value=config.get_option("printer_default", "") or "")
         self._rows = []
 
@@ -84,7 +84,7 @@ class PrintersEditor(tk.Toplevel):
             self.add_row("", "")
 
     def refresh_printers(self):
-        self._printers = printer.list_printers() or []
+        self._printers = printer.list_printers(refresh=True) or []
         for row in self._rows:
             combo: ttk.Combobox = row["combo"]
             combo["values"] = self._printers
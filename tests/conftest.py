@@ -0,0 +1,24 @@
+import pytest
+from pex import config
+from pex.services import documents, jobs, spool
+
+
+@pytest.fixture(autouse=True)
+def config_file(tmp_path, monkeypatch):
+    # Tests run on the default config, without creating config.json in the checkout
+    monkeypatch.setattr(config, "CONFIG_FILE", tmp_path / "config.json")
+    return tmp_path / "config.json"
+
+
+@pytest.fixture(autouse=True)
+def temp_path(tmp_path, monkeypatch):
+    # The job store, spool and document store of the tests live in their temporary directory
+    temp = tmp_path / "temp"
+    monkeypatch.setattr(jobs, "STORE_FILE", temp / "jobs.sqlite3")
+    monkeypatch.setattr(jobs, "LOCK_PATH", temp / "locks")
+    monkeypatch.setattr(spool, "SPOOL_PATH", temp / "spool")
+    monkeypatch.setattr(documents, "STORE_PATH", temp / "documents")
+    monkeypatch.setattr(jobs, "_queue", None)
+    monkeypatch.setattr(spool, "_spool", None)
+    monkeypatch.setattr(documents, "_store", None)
+    return temp
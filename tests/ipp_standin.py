@@ -0,0 +1,127 @@
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pex.services import cups
+
+
+def split_request(data: bytes) -> tuple[int, list[tuple[int, dict]], bytes]:
+    # Requests share the layout of responses, the status field holds the operation
+    operation, _, groups = cups.decode_response(data)
+    pos = 8
+    while data[pos] != cups.TAG_END:
+        if data[pos] < 0x10:
+            pos += 1
+            continue
+        name_length = struct.unpack(">H", data[pos + 1:pos + 3])[0]
+        pos += 3 + name_length
+        value_length = struct.unpack(">H", data[pos:pos + 2])[0]
+        pos += 2 + value_length
+    return operation, groups, data[pos + 1:]
+
+
+def _range(name: str, low: int, high: int) -> bytes:
+    key = name.encode()
+    return struct.pack(">BH", cups.TAG_RANGE, len(key)) + key + struct.pack(">Hii", 8, low, high)
+
+
+# Small IPP server speaking the subset of CUPS used by IppBackend
+class IppStandIn:
+    def __init__(self):
+        self.requests: list[tuple[int, list[tuple[int, dict]], bytes]] = []
+        self.active: set[int] = set()
+        self.printers = ["Label_Printer", "Office"]
+        # ok: answer, drop: close without answering, hang: answer too late, stale: close after answering
+        self.mode = "ok"
+        self.fail_operations: set[int] = set()
+        # Operations answered with an IPP error status instead of succeeding
+        self.error_operations: dict[int, int] = {}
+        self.connections = 0
+        self.closed = 0
+        self._job_id = 0
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with standin._lock:
+                    standin.connections += 1
+
+            def finish(self):
+                super().finish()
+                with standin._lock:
+                    standin.closed += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                operation, groups, document = split_request(data)
+                with standin._lock:
+                    standin.requests.append((operation, groups, document))
+                mode = "drop" if operation in standin.fail_operations else standin.mode
+                if mode == "drop":
+                    self.close_connection = True
+                    return
+                if mode == "hang":
+                    time.sleep(1.0)
+
+                body = standin.respond(operation, groups)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/ipp")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if mode == "stale":
+                    self.close_connection = True
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.uri = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "IppStandIn":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_closed(self, count: int, timeout: float = 2.0):
+        deadline = time.monotonic() + timeout
+        while self.closed < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def operations(self) -> list[int]:
+        return [operation for operation, _, _ in self.requests]
+
+    def respond(self, operation: int, groups: list[tuple[int, dict]]) -> bytes:
+        attributes = dict(groups[0][1]) if groups else {}
+        response = [(cups.TAG_OPERATION, [
+            (cups.TAG_CHARSET, "attributes-charset", "utf-8"),
+            (cups.TAG_LANGUAGE, "attributes-natural-language", "en"),
+        ])]
+        with self._lock:
+            if operation in (cups.IPP_PRINT_JOB, cups.IPP_CREATE_JOB):
+                self._job_id += 1
+                self.active.add(self._job_id)
+                response.append((cups.TAG_JOB, [(cups.TAG_INTEGER, "job-id", self._job_id)]))
+            elif operation == cups.IPP_GET_JOBS:
+                response += [(cups.TAG_JOB, [(cups.TAG_INTEGER, "job-id", job_id)]) for job_id in sorted(self.active)]
+            elif operation == cups.IPP_CANCEL_JOB:
+                self.active.discard(attributes["job-id"][0])
+            elif operation == cups.CUPS_GET_PRINTERS:
+                response += [(cups.TAG_PRINTER, [(cups.TAG_NAME, "printer-name", name)]) for name in self.printers]
+
+        status = self.error_operations.get(operation, 0x0000)
+        if status:
+            response[0][1].append((cups.TAG_TEXT, "status-message", "client-error-document-format-not-supported"))
+        data = bytearray(cups.encode_request(status, 1, response))
+        if operation == cups.IPP_GET_PRINTER_ATTRIBUTES:
+            data[-1:] = bytes([cups.TAG_PRINTER]) + _range("copies-supported", 1, 99) + bytes([cups.TAG_END])
+        return bytes(data)
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import pytest
+from pex.services import aserver
+
+
+@pytest.fixture
+def address():
+    loop = asyncio.new_event_loop()
+    async_server = aserver.AsyncServer("127.0.0.1", 0, threads=2, timeout=0.5)
+    listener = loop.run_until_complete(
+        asyncio.start_server(async_server.handle, "127.0.0.1", 0, limit=aserver.MAX_HEADER_SIZE)
+    )
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield listener.sockets[0].getsockname()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    listener.close()
+    # Connections kept alive by a test are closed before the loop goes away
+    for task in asyncio.all_tasks(loop):
+        task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    async_server.executor.shutdown()
+    loop.close()
+
+
+def _connect(address) -> tuple[socket.socket, "socket.SocketIO"]:
+    sock = socket.create_connection(address, timeout=3)
+    return sock, sock.makefile("rb")
+
+
+def _response(stream) -> tuple[int, dict, bytes]:
+    status = stream.readline()
+    if not status:
+        return 0, {}, b""
+    headers = {}
+    while (line := stream.readline().strip()):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return int(status.split()[1]), headers, stream.read(int(headers.get("content-length", 0)))
+
+
+def _multipart(data: bytes, boundary: str = "pex") -> bytes:
+    return (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"quantity\"\r\n\r\n1\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"label.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + data
+
+
+def test_negative_content_length_is_rejected(address):
+    sock, stream = _connect(address)
+    sock.sendall(b"POST /pex/print HTTP/1.1\r\nHost: pex\r\nContent-Length: -5\r\n\r\n")
+    status, headers, _ = _response(stream)
+    assert status == 400 and headers['connection'] == "close"
+
+
+def test_stalled_chunked_body_times_out(address):
+    sock, stream = _connect(address)
+    sock.sendall(b"POST /pex/print HTTP/1.1\r\nHost: pex\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello")
+    started = time.monotonic()
+    # The connection is closed after server timeout instead of waiting for the chunk terminator forever
+    assert stream.read() == b""
+    assert time.monotonic() - started < 2.5
+
+
+def test_invalid_chunk_terminator_is_rejected(address):
+    sock, stream = _connect(address)
+    sock.sendall(b"POST /pex/print HTTP/1.1\r\nHost: pex\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhelloXX0\r\n\r\n")
+    status, _, data = _response(stream)
+    assert status == 400
+    assert json.loads(data)['message'] == "The chunked request body is invalid."
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_non_pdf_uploads_are_rejected_on_their_first_bytes(address, chunked):
+    sock, stream = _connect(address)
+    head = _multipart(b"GIF89a")
+    if chunked:
+        sock.sendall(b"POST /pex/print HTTP/1.1\r\nHost: pex\r\nContent-Type: multipart/form-data; boundary=pex\r\n"
+                     b"Transfer-Encoding: chunked\r\n\r\n" + f"{len(head):x}\r\n".encode() + head + b"\r\n")
+    else:
+        sock.sendall(b"POST /pex/print HTTP/1.1\r\nHost: pex\r\nContent-Type: multipart/form-data; boundary=pex\r\n"
+                     b"Content-Length: 10000000\r\n\r\n" + head)
+    # Only the first bytes of the file have been sent, the rest of the body is never read
+    status, headers, data = _response(stream)
+    assert status == 415 and headers['connection'] == "close"
+    assert json.loads(data)['message'] == "The uploaded file is not a PDF document."
+
+
+def test_keep_alive(address):
+    sock, stream = _connect(address)
+    for _ in range(2):
+        sock.sendall(b"GET /pex/metrics HTTP/1.1\r\nHost: pex\r\n\r\n")
+        status, headers, data = _response(stream)
+        assert status == 200 and headers['connection'] == "keep-alive"
+        assert b"pex_async_connections" in data
+
+
+def test_pipelined_requests_are_answered_in_order(address):
+    sock, stream = _connect(address)
+    sock.sendall(
+        b"GET /pex/metrics HTTP/1.1\r\nHost: pex\r\n\r\n"
+        b"POST /pex/unknown HTTP/1.1\r\nHost: pex\r\nContent-Length: 4\r\n\r\nbody"
+        b"GET /pex/metrics HTTP/1.1\r\nHost: pex\r\nConnection: close\r\n\r\n"
+    )
+    assert [_response(stream)[0] for _ in range(3)] == [200, 404, 200]
+    assert stream.read() == b""
@@ -0,0 +1,161 @@
+import socket
+import pytest
+from ipp_standin import IppStandIn
+from pex.services import cups
+from pex.services.documents import Document
+
+
+class RecordingFallback:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, documents, printer, copies=1, options=None):
+        self.calls.append(("submit", printer))
+        return f"{printer}-lp"
+
+    def list_printers(self):
+        self.calls.append(("list_printers",))
+        return ["lp"]
+
+
+def _document(data: bytes = b"%PDF-1.4 test") -> Document:
+    return Document.from_bytes("label.pdf", data)
+
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def standin():
+    with IppStandIn() as server:
+        yield server
+
+
+def test_encode_decode_roundtrip():
+    data = cups.encode_request(cups.IPP_PRINT_JOB, 7, [
+        (cups.TAG_OPERATION, [
+            (cups.TAG_CHARSET, "attributes-charset", "utf-8"),
+            (cups.TAG_KEYWORD, "requested-attributes", ["job-id", "job-state"]),
+        ]),
+        (cups.TAG_JOB, [
+            (cups.TAG_INTEGER, "copies", 3),
+            (cups.TAG_BOOLEAN, "last-document", True),
+        ]),
+    ])
+    operation, request_id, groups = cups.decode_response(data)
+    assert (operation, request_id) == (cups.IPP_PRINT_JOB, 7)
+    assert groups == [
+        (cups.TAG_OPERATION, {'attributes-charset': ["utf-8"], 'requested-attributes': ["job-id", "job-state"]}),
+        (cups.TAG_JOB, {'copies': [3], 'last-document': [True]}),
+    ]
+
+
+def test_decode_rejects_truncated_response():
+    with pytest.raises(cups.IPPError):
+        cups.decode_response(b"\x02\x00")
+
+
+def test_print_job(standin):
+    backend = cups.IppBackend(standin.uri, timeout=2)
+    assert backend.submit(_document(b"%PDF-1.4 one"), "Office", copies=2) == "Office-1"
+
+    [(operation, groups, document)] = standin.requests
+    assert operation == cups.IPP_PRINT_JOB
+    assert document == b"%PDF-1.4 one"
+    assert groups[0][1]['printer-uri'] == ["ipp://localhost/printers/Office"]
+    assert groups[1][1]['copies'] == [2]
+
+
+def test_multiple_documents_are_one_job(standin):
+    backend = cups.IppBackend(standin.uri, timeout=2)
+    assert backend.submit([_document(b"%PDF a"), _document(b"%PDF b")], "Office") == "Office-1"
+
+    assert standin.operations() == [cups.IPP_CREATE_JOB, cups.IPP_SEND_DOCUMENT, cups.IPP_SEND_DOCUMENT]
+    assert [document for _, _, document in standin.requests] == [b"", b"%PDF a", b"%PDF b"]
+    assert [groups[0][1]['last-document'] for _, groups, _ in standin.requests[1:]] == [[False], [True]]
+
+
+def test_queries(standin):
+    backend = cups.IppBackend(standin.uri, timeout=2)
+    backend.submit(_document(), "Office")
+    backend.submit(_document(), "Office")
+
+    assert backend.list_printers() == ["Label_Printer", "Office"]
+    assert backend.active_jobs("Office") == {"Office-1", "Office-2"}
+    assert backend.supports_copies("Office") is True
+    assert backend.cancel("Office-1") is True
+    assert backend.active_jobs("Office") == {"Office-2"}
+    # Every request reused the first keep-alive connection
+    assert standin.connections == 1
+
+
+def test_falls_back_when_cups_is_unreachable():
+    fallback = RecordingFallback()
+    backend = cups.IppBackend(f"http://127.0.0.1:{_closed_port()}", timeout=1, fallback=fallback)
+
+    assert backend.submit(_document(), "Office") == "Office-lp"
+    assert backend.list_printers() == ["lp"]
+    assert fallback.calls == [("submit", "Office"), ("list_printers",)]
+
+
+def test_no_fallback_once_the_document_was_sent(standin):
+    fallback = RecordingFallback()
+    backend = cups.IppBackend(standin.uri, timeout=2, fallback=fallback)
+    standin.mode = "drop"
+
+    with pytest.raises((OSError, cups.http.client.HTTPException)) as e:
+        backend.submit(_document(), "Office")
+    assert not isinstance(e.value, cups.IPPConnectionError)
+    assert fallback.calls == []
+    assert standin.operations() == [cups.IPP_PRINT_JOB]
+
+
+def test_no_fallback_on_read_timeout(standin):
+    fallback = RecordingFallback()
+    backend = cups.IppBackend(standin.uri, timeout=0.3, fallback=fallback)
+    standin.mode = "hang"
+
+    with pytest.raises(OSError):
+        backend.submit(_document(), "Office")
+    assert fallback.calls == []
+    assert standin.operations() == [cups.IPP_PRINT_JOB]
+
+
+def test_failed_send_document_cancels_the_job(standin):
+    fallback = RecordingFallback()
+    backend = cups.IppBackend(standin.uri, timeout=2, fallback=fallback)
+    standin.fail_operations = {cups.IPP_SEND_DOCUMENT}
+
+    with pytest.raises(cups.IPPError):
+        backend.submit([_document(b"%PDF a"), _document(b"%PDF b")], "Office")
+    assert fallback.calls == []
+    assert standin.operations() == [cups.IPP_CREATE_JOB, cups.IPP_SEND_DOCUMENT, cups.IPP_CANCEL_JOB]
+    assert standin.active == set()
+
+
+def test_rejected_send_document_cancels_the_job(standin):
+    fallback = RecordingFallback()
+    backend = cups.IppBackend(standin.uri, timeout=2, fallback=fallback)
+    standin.error_operations = {cups.IPP_SEND_DOCUMENT: 0x040A}
+
+    with pytest.raises(cups.IPPError) as e:
+        backend.submit([_document(b"%PDF a"), _document(b"%PDF b")], "Office")
+    assert e.value.status == 0x040A
+    assert fallback.calls == []
+    assert standin.operations() == [cups.IPP_CREATE_JOB, cups.IPP_SEND_DOCUMENT, cups.IPP_CANCEL_JOB]
+    assert standin.active == set()
+
+
+def test_stale_pooled_connection_is_replaced(standin):
+    backend = cups.IppBackend(standin.uri, timeout=2)
+    standin.mode = "stale"
+    assert backend.submit(_document(), "Office") == "Office-1"
+    standin.wait_closed(1)
+    assert backend.submit(_document(), "Office") == "Office-2"
+
+    # The closed keep-alive connection is detected before sending, each job is printed exactly once
+    assert standin.operations() == [cups.IPP_PRINT_JOB, cups.IPP_PRINT_JOB]
+    assert standin.connections == 2
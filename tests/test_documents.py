@@ -0,0 +1,76 @@
+import hashlib
+import os
+import sys
+import pytest
+from pex.services.documents import Document, DocumentStore
+
+
+def _document(index: int, size: int = 1000) -> Document:
+    data = b"%PDF-1.4 " + str(index).encode() * size
+    return Document.from_bytes(f"{index}.pdf", data[:size])
+
+
+def _digest(index: int, size: int = 1000) -> str:
+    return hashlib.sha256((b"%PDF-1.4 " + str(index).encode() * size)[:size]).hexdigest()
+
+
+def test_lru_eviction(tmp_path):
+    store = DocumentStore(tmp_path, 2500)
+    for index in range(3):
+        assert store.put(_document(index))
+        os.utime(store.path(_digest(index)), (index, index))
+
+    assert store.contains(_digest(0)) is None
+    assert store.contains(_digest(1)) == 1000
+    assert store.stats()['size'] == 2000
+
+
+def test_pinned_documents_are_not_evicted(tmp_path):
+    store = DocumentStore(tmp_path, 2500)
+    store.put(_document(0))
+    document = store.get(_digest(0))
+    assert store.stats()['pinned'] == 1
+
+    for index in range(1, 4):
+        store.put(_document(index))
+    assert os.path.exists(document.path)
+
+    # Closing the document (when its job has finished) makes it evictable again
+    document.close()
+    store.put(_document(4))
+    assert not os.path.exists(document.path)
+    assert store.stats()['pinned'] == 0
+
+
+def test_held_uploads_are_not_evicted(tmp_path):
+    store = DocumentStore(tmp_path, 2500)
+    upload = _document(0)
+    store.put(upload)
+    assert store.hold(upload)
+
+    for index in range(1, 4):
+        store.put(_document(index))
+    assert store.contains(_digest(0)) == 1000
+    upload.close()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Pre-forked workers only exist on POSIX systems")
+def test_workers_share_the_size_limit_and_pins(tmp_path):
+    # Two stores on one directory behave like two server workers
+    first = DocumentStore(tmp_path, 2500)
+    second = DocumentStore(tmp_path, 2500)
+    first.put(_document(0))
+    document = first.get(_digest(0))
+
+    for index in range(1, 4):
+        second.put(_document(index))
+    total = sum(entry.stat().st_size for entry in os.scandir(tmp_path))
+    assert total <= 2500
+    # The document pinned by the first worker survives the evictions of the second one
+    assert os.path.exists(document.path)
+
+    # Documents stored by the other worker are found
+    other = first.get(_digest(3))
+    assert other is not None
+    other.close()
+    document.close()
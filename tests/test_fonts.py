@@ -0,0 +1,78 @@
+import re
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fpdf import FPDF
+from pex import config
+from pex.services import fonts
+
+
+def _glyph(width: int):
+    pen = TTGlyphPen(None)
+    if width:
+        pen.moveTo((0, 0))
+        pen.lineTo((0, 500))
+        pen.lineTo((width, 500))
+        pen.closePath()
+    return pen.glyph()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    widths = {".notdef": 500, "space": 0, "A": 600, "B": 700}
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(list(widths))
+    builder.setupCharacterMap({32: "space", 65: "A", 66: "B"})
+    builder.setupGlyf({name: _glyph(width) for name, width in widths.items()})
+    builder.setupHorizontalMetrics({name: (width or 250, 0) for name, width in widths.items()})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({'familyName': "PexTest", 'styleName': "Regular"})
+    builder.setupOS2(sTypoAscender=800, usWinAscent=800, usWinDescent=200)
+    builder.setupPost()
+    builder.save(str(tmp_path / "pextest.ttf"))
+
+    config.set_option("fonts", {'pextest': str(tmp_path / "pextest.ttf")})
+    registry = fonts.FontRegistry()
+    registry.load()
+    return registry
+
+
+def _render(registry: fonts.FontRegistry, text: str) -> tuple[FPDF, bytes]:
+    pdf = FPDF()
+    pdf.add_page()
+    registry.install(pdf, "pextest", "")
+    pdf.set_font("pextest", size=12)
+    pdf.cell(text=text)
+    return pdf, bytes(pdf.output())
+
+
+def _strip(data: bytes) -> bytes:
+    return re.sub(rb"/CreationDate \(.*?\)|/ID \[.*?\]", b"", data)
+
+
+def test_documents_reuse_the_parsed_font(registry, monkeypatch):
+    loaded = registry._fonts["pextest"]
+    assert loaded.shared
+
+    # Documents no longer parse the font file
+    monkeypatch.setattr(fonts.TTFFont, "__init__", lambda *_: pytest.fail("The font was parsed again"))
+    first, first_data = _render(registry, "AB")
+    second, second_data = _render(registry, "BA BA")
+
+    assert first.fonts["pextest"].cw is loaded.font.cw
+    # Each document subsets its own copy of the font file
+    assert first.fonts["pextest"].ttfont is not second.fonts["pextest"].ttfont
+    assert first.fonts["pextest"].subset is not second.fonts["pextest"].subset
+    assert b"/FontFile2" in first_data and b"/FontFile2" in second_data
+    assert loaded.font.ttfont.getGlyphOrder() == [".notdef", "space", "A", "B"]
+
+
+def test_shared_font_renders_like_add_font(registry):
+    _, shared = _render(registry, "AB BA")
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.add_font("pextest", "", str(registry._fonts["pextest"].path))
+    pdf.set_font("pextest", size=12)
+    pdf.cell(text="AB BA")
+    assert _strip(shared) == _strip(bytes(pdf.output()))
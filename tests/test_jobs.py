@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import Future
+import pytest
+from pex import config
+from pex.services import jobs, printer
+from pex.services.jobs import JOB_DONE, JOB_QUEUED, JOB_SPOOLING, Job, JobQueue, PrinterQueue, QueueFull
+from pex.services.printer import Submission
+
+
+def _job(size: int = 0) -> Job:
+    job = Job("file", "Office", None, payload={'quantity': 1})
+    job.size = size
+    return job
+
+
+def test_concurrent_submissions_do_not_overshoot_the_limits():
+    pending = PrinterQueue()
+    admitted, rejected = [], []
+
+    def submit():
+        job = _job(100)
+        try:
+            # A slow store write between the check and the insert used to let every submission through
+            pending.admit_and_put(job, 5, 300, prepare=lambda _: time.sleep(0.01))
+            admitted.append(job)
+        except QueueFull:
+            rejected.append(job)
+
+    threads = [threading.Thread(target=submit) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(admitted) == 3 and len(rejected) == 17
+    assert pending.qsize() == 3
+    assert pending.queued_bytes() == 300
+
+
+def test_failed_preparation_does_not_queue_the_job():
+    pending = PrinterQueue()
+
+    def fail(_):
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        pending.admit_and_put(_job(), 5, 0, prepare=fail)
+    assert pending.qsize() == 0
+
+
+def test_announced_uploads_are_checked_against_the_remaining_bytes():
+    pending = PrinterQueue()
+    pending.admit_and_put(_job(200), 0, 300)
+
+    pending.admit_size("Office", 100, 300)
+    with pytest.raises(QueueFull) as e:
+        pending.admit_size("Office", 101, 300)
+    assert e.value.details['content_length'] == 101
+    assert e.value.retry_after > 0
+    # Without a byte limit every size is admitted
+    pending.admit_size("Office", 10 ** 9, 0)
+
+
+def test_workers_do_not_wait_for_the_printer():
+    queue_ = JobQueue()
+    spooled = []
+    completions = []
+
+    def task(job: Job) -> Submission:
+        job.advance(JOB_SPOOLING)
+        spooled.append(time.monotonic())
+        completion = Future()
+        completions.append(completion)
+        return Submission(["Office-1"], completion)
+
+    started = time.monotonic()
+    submitted = [queue_.submit(Job("file", "Office", task)) for _ in range(4)]
+    deadline = time.monotonic() + 2
+    while len(spooled) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Every job reached the spooler although none of them has been printed yet
+    assert len(spooled) == 4 and spooled[-1] - started < 0.5
+    assert [job.state for job in submitted] == [JOB_SPOOLING] * 4
+
+    time.sleep(0.05)
+    for completion in completions:
+        completion.set_result(True)
+    assert all(job.wait(1) for job in submitted)
+    assert [job.state for job in submitted] == [JOB_DONE] * 4
+    assert all(job.stages['wait'] >= 0.05 for job in submitted)
+
+
+def test_identical_label_jobs_are_coalesced_per_printer_and_format(monkeypatch):
+    config.set_option("jobs.coalesce_ms", 200)
+    monkeypatch.setattr(printer, "printer_exists", lambda _: True)
+    spooled = []
+
+    def spool_document(document, target, paper_format, fmt, orientation, quantity):
+        document.close()
+        spooled.append((target, paper_format, quantity))
+        return Submission()
+    monkeypatch.setattr(printer, "spool_document", spool_document)
+
+    lines = [{'text': "Shelf 12"}]
+    first = jobs.submit_lines(lines, "Office", "A4")
+    assert jobs.submit_lines(lines, "Office", "A4", quantity=2) is first
+    assert jobs.submit_lines(lines, "Office", "A4", quantity=3) is first
+    other_format = jobs.submit_lines(lines, "Office", "A5")
+    other_printer = jobs.submit_lines(lines, "Labels", "A4")
+    other_text = jobs.submit_lines([{'text': "Shelf 13"}], "Office", "A4")
+
+    assert len({first.id, other_format.id, other_printer.id, other_text.id}) == 4
+    assert first.coalesced == 2 and first.payload['quantity'] == 6
+    assert all(job.wait(2) for job in (first, other_format, other_printer, other_text))
+    assert sorted(spooled) == [("Labels", "A4", 1), ("Office", "A4", 1), ("Office", "A4", 6), ("Office", "A5", 1)]
+
+
+def test_priority_beats_cost():
+    pending = PrinterQueue(aging=0)
+    small = Job("file", "Office", None, cost=1)
+    large = Job("file", "Office", None, cost=50)
+    urgent = Job("file", "Office", None, priority=5, cost=100)
+    low = Job("file", "Office", None, priority=-5, cost=0)
+    for job in (low, large, small, urgent):
+        pending.admit_and_put(job, 0, 0)
+
+    # Within a priority the cheapest job goes first
+    assert [pending.get() for _ in range(4)] == [urgent, small, large, low]
+
+
+@pytest.mark.parametrize("aging, first", [(0, "small"), (10, "large")])
+def test_waiting_jobs_overtake_cheaper_ones(aging, first):
+    pending = PrinterQueue(aging=aging)
+    large = Job("file", "Office", None, cost=50)
+    # The large job has been waiting for 10 seconds, with aging it is now cheaper than the new one
+    large._marks[JOB_QUEUED] -= 10
+    small = Job("file", "Office", None, cost=1)
+    pending.admit_and_put(large, 0, 0)
+    pending.admit_and_put(small, 0, 0)
+
+    assert pending.get() is {'small': small, 'large': large}[first]
@@ -0,0 +1,40 @@
+import sqlite3
+from pex.services.jobs import Job
+from pex.services.jobstore import JobStore
+
+
+def test_stored_jobs_have_the_shape_of_live_jobs(tmp_path):
+    store = JobStore(tmp_path / "jobs.sqlite3")
+    job = Job("lines", "Office", None, payload={'quantity': 1}, priority=3, cost=2.345)
+    job.coalesced = 2
+    store.save(job, job.payload)
+
+    stored = store.get(job.id)
+    live = job.to_dict()
+    assert stored.keys() == live.keys()
+    assert {key: stored[key] for key in ('priority', 'cost', 'coalesced')} == {'priority': 3, 'cost': 2.35, 'coalesced': 2}
+
+    rows, cursor = store.query(printer="Office")
+    assert rows == [stored] and cursor is None
+
+
+def test_older_stores_are_migrated(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE jobs (
+            id TEXT PRIMARY KEY, type TEXT NOT NULL, printer TEXT NOT NULL, state TEXT NOT NULL, error TEXT,
+            spool_ids TEXT NOT NULL DEFAULT '[]', payload TEXT, timings TEXT NOT NULL DEFAULT '{}',
+            created_at REAL NOT NULL, updated_at REAL NOT NULL
+        );
+        INSERT INTO jobs VALUES ('old', 'file', 'Office', 'queued', NULL, '[]', '{}', '{}', 1.0, 1.0);
+    """)
+    conn.close()
+
+    store = JobStore(path)
+    assert store.get('old')['priority'] == 0
+    assert store.get('old')['cost'] == 1.0
+    assert store.get('old')['coalesced'] == 0
+    # Jobs of stores without owners belong to no worker
+    assert store.unfinished(("done", "failed"), owners=[1]) == []
+    assert len(store.unfinished(("done", "failed"))) == 1
@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from fpdf import FPDF
+from pex import config
+from pex.services import labels
+
+
+@pytest.fixture
+def render_processes(monkeypatch):
+    # Threads stand in for the render processes, the pool handling is the same
+    monkeypatch.setattr(labels, "ProcessPoolExecutor", lambda max_workers, **_: ThreadPoolExecutor(max_workers))
+    yield
+    config.set_option("render.processes", 0)
+    assert labels.get_render_pool() is None
+
+
+def test_replaced_render_pool_finishes_leased_renders(render_processes):
+    config.set_option("render.processes", 1)
+    with labels._lease_render_pool() as pool:
+        config.set_option("render.processes", 2)
+        assert labels.get_render_pool() is not pool
+        # A render which got the pool before the config change can still submit to it
+        assert pool.submit(labels._warm_render_worker).result() is True
+
+    # The last user shuts the replaced pool down
+    with pytest.raises(RuntimeError):
+        pool.submit(labels._warm_render_worker)
+
+
+@pytest.fixture
+def pdf():
+    pdf = FPDF()
+    pdf.add_page()
+    return pdf
+
+
+def test_words_wider_than_the_label_are_broken(pdf):
+    wrapped = labels._wrap_text({'text': "Box " + "W" * 40}, pdf, 30)
+    assert [line['text'] for line in wrapped][0] == "Box"
+    assert "".join(line['text'] for line in wrapped[1:]) == "W" * 40
+    assert len(wrapped) > 2
+    assert all(0 < line['width'] <= 30 for line in wrapped)
+    assert all(line['width'] == pytest.approx(pdf.get_string_width(line['text'])) for line in wrapped)
+
+
+def test_lines_are_measured_in_their_own_style(pdf):
+    text = "Shelf 12 EUR 4.99"
+    regular = labels._wrap_text({'text': text}, pdf, 100, font_size=12)
+    bold = labels._wrap_text({'text': text, 'bold': True}, pdf, 100, font_size=12)
+    assert bold[0]['width'] > regular[0]['width']
+
+    # A width that fits the regular text wraps the bold one
+    width = regular[0]['width']
+    assert len(labels._wrap_text({'text': text}, pdf, width, font_size=12)) == 1
+    assert len(labels._wrap_text({'text': text, 'bold': True}, pdf, width, font_size=12)) == 2
+
+
+def test_empty_lines_are_kept(pdf):
+    lines = [{'text': "Shelf 12"}, {'text': ""}, {'text': "   "}, {'text': "EUR 4.99"}]
+    wrapped = [wrapped for line in lines for wrapped in labels._wrap_text(line, pdf, 100)]
+    assert [line['text'] for line in wrapped] == ["Shelf 12", "", "", "EUR 4.99"]
+    assert wrapped[1]['width'] == 0
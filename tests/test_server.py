@@ -0,0 +1,102 @@
+import io
+import json
+import pytest
+from pex import config
+from pex.services import documents, jobs, printer, server
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+@pytest.fixture
+def office_almost_full():
+    # Office has 900 of its 1000 bytes queued
+    config.set_option("printer_default", "Office")
+    config.set_option("jobs.max_queued_bytes", 1000)
+    pending = jobs.PrinterQueue()
+    jobs.get_queue()._queues["Office"] = pending
+    blocker = jobs.Job("file", "Office", None)
+    blocker.size = 900
+    pending.admit_and_put(blocker, 0, 0)
+    return pending
+
+
+@pytest.fixture
+def spooled(monkeypatch):
+    monkeypatch.setattr(printer, "printer_exists", lambda _: True)
+    calls = []
+
+    def spool_documents(entries, target, *_):
+        calls.append((target, [(b"".join(document.chunks()), quantity) for document, quantity in entries]))
+        for document, _ in entries:
+            document.close()
+        return printer.Submission()
+    monkeypatch.setattr(printer, "spool_documents", spool_documents)
+    return calls
+
+
+def _pdf(size: int = 500) -> tuple[io.BytesIO, str]:
+    return io.BytesIO(b"%PDF-1.4 " + b"0" * (size - 9)), "label.pdf"
+
+
+def test_labels_for_another_printer_are_not_charged_to_the_default_printer(client, office_almost_full):
+    response = client.post("/pex/print", data={'printer': "Labels", 'lines': ["x" * 2000]})
+    assert response.status_code != 429
+
+
+def test_uploads_are_checked_against_the_printer_of_the_form(client, office_almost_full):
+    response = client.post("/pex/print", data={'file': _pdf()}, content_type="multipart/form-data")
+    assert response.status_code == 429
+    assert response.get_json()['details']['printer'] == "Office"
+    assert response.headers['Retry-After']
+
+    response = client.post("/pex/print", data={'printer': "Labels", 'file': _pdf()}, content_type="multipart/form-data")
+    assert response.status_code != 429
+
+
+def test_printer_in_the_url_is_checked_before_parsing(client, office_almost_full, monkeypatch):
+    def parse(*_):
+        raise AssertionError("The body must not be parsed")
+    monkeypatch.setattr(server.PexRequest, "_get_file_stream", parse)
+
+    response = client.post("/pex/print?printer=Office", data={'file': _pdf()}, content_type="multipart/form-data")
+    assert response.status_code == 429
+    assert response.get_json()['details']['content_length'] > 500
+
+
+@pytest.mark.parametrize("store_size", [None, 0])
+def test_batch_items_share_an_upload(client, spooled, store_size):
+    if store_size is not None:
+        config.set_option("documents.max_size", store_size)
+    items = [
+        {'file': "label", 'quantity': 2},
+        {'lines': [{'text': "Box 1"}]},
+        {'file': "label", 'printer': "Labels"},
+        {'file': "label"},
+    ]
+    response = client.post(
+        "/pex/print/batch?wait=1",
+        data={'printer': "Office", 'items': json.dumps(items), 'label': _pdf()},
+        content_type="multipart/form-data"
+    )
+    assert response.status_code == 200, response.get_json()
+    results = response.get_json()['result']['items']
+    assert [result['error'] for result in results] == [None] * 4
+
+    # The files and labels for one printer are a single spool job
+    spooled = dict(spooled)
+    pdf = _pdf()[0].getvalue()
+    assert [(data, quantity) for data, quantity in spooled["Office"] if data == pdf] == [(pdf, 2), (pdf, 1)]
+    assert len(spooled["Office"]) == 3 and spooled["Office"][1][0].startswith(b"%PDF")
+    assert spooled["Labels"] == [(pdf, 1)]
+
+
+def test_invalid_digests_do_not_reach_the_store(client, monkeypatch):
+    queried = []
+    monkeypatch.setattr(documents.DocumentStore, "contains", lambda _, digest: queried.append(digest))
+    for digest in ("..", "a" * 63, "g" * 64, "a" * 64 + ".pdf"):
+        assert client.head(f"/pex/documents/{digest}").status_code == 400
+    assert client.head(f"/pex/documents/{'A' * 64}").status_code == 404
+    assert queried == ["a" * 64]
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import uuid
+import pytest
+from pex.services.documents import Document
+from pex.services.spool import SpoolManager
+
+
+def _spool_file(directory, pid: int, age: float = 0) -> str:
+    path = str(directory / f"{pid}-{uuid.uuid4().hex}.pdf")
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4")
+    if age:
+        os.utime(path, (os.path.getmtime(path) - age,) * 2)
+    return path
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Pre-forked workers only exist on POSIX systems")
+def test_sweep_keeps_files_of_live_workers(tmp_path):
+    spool = SpoolManager(tmp_path, max_age=60)
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+
+    other_worker = _spool_file(tmp_path, os.getppid(), age=3600)
+    orphan = _spool_file(tmp_path, dead.pid)
+    lost = _spool_file(tmp_path, os.getpid(), age=3600)
+    fresh = _spool_file(tmp_path, os.getpid())
+    printing = spool.create(Document.from_bytes("label.pdf", b"%PDF-1.4"))
+    os.utime(printing, (os.path.getmtime(printing) - 3600,) * 2)
+
+    assert spool.sweep() == 2
+    # A stale file of another live worker may still be handed to the print program by that worker
+    assert os.path.exists(other_worker)
+    assert not os.path.exists(orphan)
+    assert not os.path.exists(lost)
+    assert os.path.exists(fresh)
+    assert os.path.exists(printing)
+
+    spool.release(printing)
+    assert spool.stats()['size'] == 0